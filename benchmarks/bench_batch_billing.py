@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Compares pricing instances one by one with pricing them as a batch
+
+Usage:
+    bench_batch_billing.py [--instances=<n>]
+    bench_batch_billing.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --instances=<n>       Number of synthetic instances [default: 100000]
+"""
+
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil import tz  # noqa: E402
+from docopt import docopt  # noqa: E402
+
+from benchmarks import fixtures  # noqa: E402
+from calculator.batch import InstanceBatch  # noqa: E402
+from calculator.calculator import (  # noqa: E402
+    Ec2EmrPricing,
+    Ec2Instance,
+    EmrCostCalculator,
+    InstanceGroup,
+    SpotPricing,
+)
+from calculator.spot_series import SpotPriceSeries  # noqa: E402
+
+REGION = "us-east-1"
+AVAILABILITY_ZONE = "us-east-1a"
+START = datetime.datetime(2024, 1, 1, tzinfo=tz.tzutc()).timestamp()
+SPAN = 30 * 24 * 3600
+EBS = [
+    {"VolumeSpecification": {"SizeInGB": 64}},
+    {"VolumeSpecification": {"SizeInGB": 32}},
+]
+
+
+def build_calculator():
+    """
+    :return: An EmrCostCalculator whose prices and spot price histories are
+            all in memory
+    """
+    instance_types = [fixtures.instance_type_name(i) for i in range(8)]
+    pricing = Ec2EmrPricing.from_prices(
+        REGION,
+        {t: 0.1 * (i + 1) for i, t in enumerate(instance_types)},
+        {t: 0.02 * (i + 1) for i, t in enumerate(instance_types)},
+    )
+    spot_pricing = SpotPricing(region=REGION)
+    for i, instance_type in enumerate(instance_types):
+        points = fixtures.spot_price_history(START - 3600, START + SPAN + 86400, i)
+        series = SpotPriceSeries([p[0] for p in points], [p[1] for p in points])
+        series.covered_start, series.covered_end = points[0][0], points[-1][0]
+        spot_pricing.all_prices[(instance_type, AVAILABILITY_ZONE)] = series
+
+    return EmrCostCalculator(
+        region=REGION,
+        emr_client=object(),
+        spot_pricing=spot_pricing,
+        ec2_emr_pricing=pricing,
+    )
+
+
+def main():
+    args = docopt(__doc__)
+    records = fixtures.instance_records(int(args["--instances"]), START, SPAN)
+    calculator = build_calculator()
+    groups = {
+        group_type: InstanceGroup(group_type, None, group_type, EBS)
+        for group_type in ("MASTER", "CORE", "TASK")
+    }
+
+    instances = [
+        Ec2Instance(
+            datetime.datetime.fromtimestamp(start, tz=tz.tzutc()),
+            datetime.datetime.fromtimestamp(end, tz=tz.tzutc()),
+            instance_type,
+            market,
+            [],
+        )
+        for start, end, instance_type, market, _ in records
+    ]
+    started = time.perf_counter()
+    scalar = {}
+    for instance, record in zip(instances, records):
+        calculator._add_instance_cost(
+            scalar, groups[record[4]], instance, AVAILABILITY_ZONE
+        )
+    scalar_time = time.perf_counter() - started
+
+    batch = InstanceBatch()
+    ebs_size = sum(ebs["VolumeSpecification"]["SizeInGB"] for ebs in EBS)
+    for start, end, instance_type, market, group_type in records:
+        batch.append(
+            start, end, instance_type, market, group_type, AVAILABILITY_ZONE, ebs_size
+        )
+    started = time.perf_counter()
+    batched = calculator.get_batch_cost(batch)
+    batch_time = time.perf_counter() - started
+
+    print("Instances: {}".format(len(records)))
+    print("scalar  {:7.3f}s  TOTAL {:.2f}".format(scalar_time, scalar["TOTAL"]))
+    print("batch   {:7.3f}s  TOTAL {:.2f}".format(batch_time, batched["TOTAL"]))
+    mismatches = [
+        key for key in scalar if round(scalar[key], 2) != round(batched[key], 2)
+    ]
+    if mismatches:
+        print("[ERROR] Totals differ for {}".format(", ".join(sorted(mismatches))))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Measures the memory used to read the instances of a big cluster
+
+Usage:
+    bench_instance_records.py [--instances=<n>]
+    bench_instance_records.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --instances=<n>       Number of synthetic instances [default: 100000]
+
+Modes:
+    raw       every list_instances page is kept, as the calculator used to do
+    records   only the Ec2Instance records are kept
+    stream    instances are consumed as they are read
+"""
+
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil import tz  # noqa: E402
+from docopt import docopt  # noqa: E402
+
+from benchmarks import fixtures  # noqa: E402
+from benchmarks.fake_aws import FakeEmrClient  # noqa: E402
+from calculator.calculator import EmrCostCalculator, InstanceGroup  # noqa: E402
+from calculator.rate_limit import RateLimiter  # noqa: E402
+
+CLUSTER_ID = "j-BENCHMARK"
+GROUP_ID = "ig-BENCHMARK"
+START = datetime.datetime(2024, 1, 1, tzinfo=tz.tzutc()).timestamp()
+
+
+def run(mode, calculator, group):
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "raw":
+        kept = []
+        kwargs = {"ClusterId": CLUSTER_ID, "InstanceGroupId": GROUP_ID}
+        while True:
+            page = calculator.conn.list_instances(**kwargs)
+            kept.extend(page["Instances"])
+            if "Marker" not in page:
+                break
+            kwargs["Marker"] = page["Marker"]
+        kept = list(calculator._parse_instances(kept, CLUSTER_ID, None, None))
+    elif mode == "records":
+        kept = list(calculator._get_instances(group, CLUSTER_ID, None, None))
+    else:
+        kept = sum(1 for _ in calculator._get_instances(group, CLUSTER_ID, None, None))
+    wall_time = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return wall_time, peak
+
+
+def main():
+    args = docopt(__doc__)
+    count = int(args["--instances"])
+    records = fixtures.instance_records(count, START, 30 * 24 * 3600)
+
+    calculator = EmrCostCalculator(
+        region="us-east-1",
+        emr_client=FakeEmrClient({CLUSTER_ID: {GROUP_ID: ("TASK", records)}}),
+        spot_pricing=object(),
+        ec2_emr_pricing=object(),
+        # the fake client is never throttled
+        rate_limiter=RateLimiter(),
+    )
+    group = InstanceGroup(GROUP_ID, None, "TASK", [])
+
+    print("Instances: {}".format(count))
+    for mode in ("raw", "records", "stream"):
+        wall_time, peak = run(mode, calculator, group)
+        print(
+            "{:8s} wall time: {:6.2f}s  peak memory: {:8.1f} MB ({:5.0f} bytes per "
+            "instance)".format(mode, wall_time, peak / 1024.0 / 1024.0, peak / count)
+        )
+
+
+if __name__ == "__main__":
+    main()
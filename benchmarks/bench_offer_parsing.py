@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Compares loading an EC2 offer file as a whole with parsing it as a stream
+
+Every mode runs in its own process so peak RSS is measured independently.
+
+Usage:
+    bench_offer_parsing.py [--offer_file=<path>] [--products=<n>]
+    bench_offer_parsing.py --run=<mode> --offer_file=<path>
+    bench_offer_parsing.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --offer_file=<path>   Recorded offer file to parse. A synthetic one is
+    generated if it is not given
+    --products=<n>        Number of SKUs of the synthetic offer file
+    [default: 20000]
+    --run=<mode>          Internal: parse the file once with the given mode
+    (document or stream) and print the measurements as JSON
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docopt import docopt  # noqa: E402
+
+from benchmarks import fixtures  # noqa: E402
+from calculator import offer_parser  # noqa: E402
+
+MODES = ["document", "stream"]
+
+
+def peak_rss_kb():
+    """
+    ru_maxrss is inherited from the parent process across fork and exec on
+    Linux, so prefer the high water mark of this process' own address space.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_mode(mode, offer_file):
+    start = time.perf_counter()
+    if mode == "document":
+        # what Ec2EmrPricing did before: requests' json() on the whole body
+        with open(offer_file, "rb") as f:
+            document = json.loads(f.read())
+        prices = offer_parser.parse_offer_document(
+            document, offer_parser.select_ec2_product, unique_instance_types=True
+        )
+    else:
+        prices = offer_parser.parse_ec2_offer(offer_parser.iter_file_chunks(offer_file))
+    wall_time = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "wall_time": wall_time,
+                "peak_rss_kb": peak_rss_kb(),
+                "instance_types": len(prices),
+            }
+        )
+    )
+
+
+def main():
+    args = docopt(__doc__)
+    if args.get("--run"):
+        run_mode(args["--run"], args["--offer_file"])
+        return
+
+    offer_file = args.get("--offer_file")
+    tmp_dir = None
+    if offer_file is None:
+        tmp_dir = tempfile.mkdtemp()
+        offer_file = os.path.join(tmp_dir, "ec2_offer.json")
+        fixtures.write_json(offer_file, fixtures.ec2_offer(int(args["--products"])))
+
+    print(
+        "Offer file: {} ({:.1f} MB)".format(
+            offer_file, os.path.getsize(offer_file) / 1024.0 / 1024.0
+        )
+    )
+    results = []
+    for mode in MODES:
+        output = subprocess.check_output(
+            [sys.executable, __file__, "--run=" + mode, "--offer_file=" + offer_file]
+        )
+        results.append(json.loads(output.decode()))
+    if tmp_dir is not None:
+        os.remove(offer_file)
+        os.rmdir(tmp_dir)
+
+    if len(set(r["instance_types"] for r in results)) != 1:
+        print("[ERROR] Modes disagree on the number of instance types")
+    for r in results:
+        print(
+            "{:10s} wall time: {:7.2f}s  peak RSS: {:8.1f} MB  instance types: {}".format(
+                r["mode"],
+                r["wall_time"],
+                r["peak_rss_kb"] / 1024.0,
+                r["instance_types"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Measures the speedup of parsing an EC2 offer file with a process pool
+
+Usage:
+    bench_parallel_parsing.py [--offer_file=<path>] [--products=<n>]
+    [--workers=<list>]
+    bench_parallel_parsing.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --offer_file=<path>   Recorded offer file to parse. A synthetic one is
+    generated if it is not given
+    --products=<n>        Number of SKUs of the synthetic offer file
+    [default: 20000]
+    --workers=<list>      Comma separated numbers of worker processes
+    [default: 1,2,4,8]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docopt import docopt  # noqa: E402
+
+from benchmarks import fixtures  # noqa: E402
+from calculator import offer_parser  # noqa: E402
+
+
+def main():
+    args = docopt(__doc__)
+    offer_file = args.get("--offer_file")
+    tmp_dir = None
+    if offer_file is None:
+        tmp_dir = tempfile.mkdtemp()
+        offer_file = os.path.join(tmp_dir, "ec2_offer.json")
+        fixtures.write_json(offer_file, fixtures.ec2_offer(int(args["--products"])))
+
+    print(
+        "Offer file: {} ({:.1f} MB), {} CPUs".format(
+            offer_file, os.path.getsize(offer_file) / 1024.0 / 1024.0, os.cpu_count()
+        )
+    )
+    baseline = None
+    expected = None
+    try:
+        for workers in [int(w) for w in args["--workers"].split(",")]:
+            start = time.perf_counter()
+            prices = offer_parser.parse_ec2_offer(
+                offer_parser.iter_file_chunks(offer_file), workers=workers
+            )
+            wall_time = time.perf_counter() - start
+            if expected is None:
+                expected, baseline = prices, wall_time
+            elif list(prices.items()) != list(expected.items()):
+                print("[ERROR] {} workers give a different table".format(workers))
+                sys.exit(1)
+            print(
+                "{:2d} workers  wall time: {:7.2f}s  speedup: {:5.2f}x".format(
+                    workers, wall_time, baseline / wall_time
+                )
+            )
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
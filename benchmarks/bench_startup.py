@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Measures the start up time of the command line tool
+
+Every case runs the tool in a fresh process, like a user or a scheduler
+does: printing the help, importing the calculator, and a total over a period
+fully answered by a cost ledger, which needs no AWS client and no price list.
+
+Usage:
+    bench_startup.py [--repeat=<n>] [--budget=<seconds>]
+    bench_startup.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --repeat=<n>          Runs per case, the median is reported [default: 5]
+    --budget=<seconds>    Fail if the median of a case exceeds it
+    [default: 1.0]
+"""
+
+import datetime
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from docopt import docopt  # noqa: E402
+
+from calculator.ledger import CostLedger  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, "aws-emr-cost-calculator2")
+CLUSTERS = 1000
+REGION = "us-east-1"
+
+
+def _write_ledger(path):
+    """
+    Stores terminated clusters created over January 2024 and records the
+    month as listed
+    """
+    ledger = CostLedger(path)
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(CLUSTERS):
+        ledger.store(
+            REGION,
+            "j-{:012d}".format(i),
+            start + datetime.timedelta(minutes=40 * i),
+            "TERMINATED",
+            {"MASTER.EC2": 1.0, "MASTER.EMR": 0.25, "TOTAL": 1.25},
+        )
+    ledger.record_listing(REGION, start, datetime.datetime(2024, 2, 1))
+    ledger.close()
+
+
+def _time(command, repeat):
+    wall_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wall_times.append(time.perf_counter() - started)
+    return statistics.median(wall_times)
+
+
+def main():
+    args = docopt(__doc__)
+    repeat = int(args["--repeat"])
+    budget = float(args["--budget"])
+    workdir = tempfile.mkdtemp()
+    try:
+        ledger = os.path.join(workdir, "ledger.sqlite")
+        _write_ledger(ledger)
+        cases = [
+            ("python", [sys.executable, "-c", "pass"]),
+            ("import", [sys.executable, "-c", "import calculator.calculator"]),
+            ("help", [sys.executable, SCRIPT, "-h"]),
+            (
+                "ledger total",
+                [
+                    sys.executable,
+                    SCRIPT,
+                    "total",
+                    "--created_after=2024-01-01 00:00",
+                    "--created_before=2024-02-01 00:00",
+                    "--region=" + REGION,
+                    "--ledger=" + ledger,
+                    "--no_cache",
+                ],
+            ),
+        ]
+        over_budget = False
+        for name, command in cases:
+            try:
+                wall_time = _time(command, repeat)
+            except subprocess.CalledProcessError as e:
+                print("{:15s} failed with exit status {}".format(name, e.returncode))
+                over_budget = True
+                continue
+            over_budget = over_budget or wall_time > budget
+            print(
+                "{:15s} {:7.3f}s{}".format(
+                    name, wall_time, "  over budget" if wall_time > budget else ""
+                )
+            )
+    finally:
+        shutil.rmtree(workdir)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
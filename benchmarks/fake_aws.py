@@ -0,0 +1,299 @@
+"""
+In memory stand-ins for the boto3 clients and a local stand-in for the
+pricing API, serving synthetic fixtures and counting the calls made to every
+operation.
+"""
+
+import collections
+import datetime
+import email.utils
+import gzip
+import http.server
+import os
+import random
+import threading
+
+from dateutil import tz
+
+from benchmarks import fixtures
+
+AVAILABILITY_ZONE = "us-east-1a"
+EBS_BLOCK_DEVICES = [
+    {"VolumeSpecification": {"VolumeType": "gp2", "SizeInGB": 64}, "Device": "/dev/sdb"}
+]
+
+
+class _CountingClient:
+    def __init__(self):
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+
+class FakeEmrClient(_CountingClient):
+    """
+    Serves clusters made of instance groups, or of instance fleets
+    :param clusters: {cluster_id: {group_id: (group_type, instance_records)}}
+            where instance_records come from fixtures.instance_records
+    :param fleets: Serve the groups as instance fleets, with a specification
+            per instance type of their records
+    """
+
+    def __init__(self, clusters, page_size=50, fleets=False):
+        super().__init__()
+        self.clusters = clusters
+        self.page_size = page_size
+        self.fleets = fleets
+
+    def list_clusters(self, Marker="0", **kwargs):
+        self._count("list_clusters")
+        cluster_ids = sorted(self.clusters)
+        start = int(Marker)
+        response = {
+            "Clusters": [
+                {
+                    "Id": cluster_id,
+                    "Name": cluster_id,
+                    "Status": {
+                        "State": "TERMINATED",
+                        "Timeline": {
+                            "CreationDateTime": datetime.datetime(
+                                2024, 1, 1, tzinfo=tz.tzutc()
+                            )
+                        },
+                    },
+                    "NormalizedInstanceHours": 1,
+                }
+                for cluster_id in cluster_ids[start : start + self.page_size]
+            ]
+        }
+        if start + self.page_size < len(cluster_ids):
+            response["Marker"] = str(start + self.page_size)
+        return response
+
+    def describe_cluster(self, ClusterId):
+        self._count("describe_cluster")
+        return {
+            "Cluster": {
+                "Id": ClusterId,
+                "Status": {"State": "TERMINATED"},
+                "Ec2InstanceAttributes": {"Ec2AvailabilityZone": AVAILABILITY_ZONE},
+                "InstanceCollectionType": (
+                    "INSTANCE_FLEET" if self.fleets else "INSTANCE_GROUP"
+                ),
+                "NormalizedInstanceHours": 1,
+            }
+        }
+
+    def list_instance_groups(self, ClusterId, **kwargs):
+        self._count("list_instance_groups")
+        return {
+            "InstanceGroups": [
+                {
+                    "Id": group_id,
+                    "InstanceGroupType": group_type,
+                    "InstanceType": records[0][2] if records else "m5.xlarge",
+                    "EbsBlockDevices": EBS_BLOCK_DEVICES,
+                }
+                for group_id, (group_type, records) in sorted(
+                    self.clusters[ClusterId].items()
+                )
+            ]
+        }
+
+    def list_instance_fleets(self, ClusterId, **kwargs):
+        self._count("list_instance_fleets")
+        return {
+            "InstanceFleets": [
+                {
+                    "Id": group_id,
+                    "InstanceFleetType": group_type,
+                    "InstanceTypeSpecifications": [
+                        {
+                            "InstanceType": instance_type,
+                            "WeightedCapacity": 1,
+                            "EbsBlockDevices": fleet_ebs_block_devices(instance_type),
+                        }
+                        for instance_type in sorted(set(r[2] for r in records))
+                    ],
+                }
+                for group_id, (group_type, records) in sorted(
+                    self.clusters[ClusterId].items()
+                )
+            ]
+        }
+
+    def list_instances(
+        self,
+        ClusterId,
+        InstanceGroupId=None,
+        InstanceFleetId=None,
+        Marker="0",
+        **kwargs
+    ):
+        self._count("list_instances")
+        group_id = InstanceFleetId or InstanceGroupId
+        _, records = self.clusters[ClusterId][group_id]
+        return fixtures.list_instances_page(
+            records, group_id, int(Marker), self.page_size, fleet=self.fleets
+        )
+
+
+def fleet_ebs_block_devices(instance_type):
+    """
+    :return: The EBS volumes of the fleet specification of an instance type,
+            a size that differs from one type to the other
+    """
+    return [
+        {
+            "VolumeSpecification": {
+                "VolumeType": "gp2",
+                "SizeInGB": 32 * (1 + len(instance_type) % 4),
+            },
+            "Device": "/dev/sdb",
+        }
+    ]
+
+
+class FakeEc2Client(_CountingClient):
+    """
+    Serves a synthetic spot price history for every instance type, with one
+    price change every `interval` seconds on average
+    """
+
+    def __init__(self, interval=3 * 3600, page_size=1000):
+        super().__init__()
+        self.interval = interval
+        self.page_size = page_size
+
+    def _history(self, instance_type, availability_zone, start, end):
+        # the price in effect at start plus every change until end, newest
+        # first, like the real API
+        rng = random.Random(instance_type + availability_zone)
+        step = int(self.interval)
+        first = start - start % step
+        points = []
+        ts = first
+        while ts <= end:
+            rng.seed("{}{}{}".format(instance_type, availability_zone, ts))
+            points.append((ts, "{:.4f}".format(rng.uniform(0.01, 0.5))))
+            ts += step
+        points.reverse()
+        return points
+
+    def describe_spot_price_history(
+        self,
+        InstanceTypes,
+        AvailabilityZone,
+        StartTime,
+        EndTime,
+        NextToken="",
+        **kwargs
+    ):
+        self._count("describe_spot_price_history")
+        points = self._history(
+            InstanceTypes[0],
+            AvailabilityZone,
+            int(StartTime.timestamp()),
+            int(EndTime.timestamp()),
+        )
+        start = int(NextToken or 0)
+        page = points[start : start + self.page_size]
+        return {
+            "SpotPriceHistory": [
+                {
+                    "AvailabilityZone": AvailabilityZone,
+                    "InstanceType": InstanceTypes[0],
+                    "ProductDescription": "Linux/UNIX (Amazon VPC)",
+                    "SpotPrice": price,
+                    "Timestamp": datetime.datetime.fromtimestamp(ts, tz=tz.tzutc()),
+                }
+                for ts, price in page
+            ],
+            "NextToken": (
+                str(start + self.page_size)
+                if start + self.page_size < len(points)
+                else ""
+            ),
+        }
+
+
+def synthetic_clusters(clusters, instances, start, span, seed=0):
+    """
+    :param clusters: Number of clusters
+    :param instances: Number of instances per cluster
+    :return: The clusters argument of FakeEmrClient
+    """
+    result = {}
+    for c in range(clusters):
+        records = fixtures.instance_records(instances, start, span, seed + c)
+        groups = {}
+        for group_type in ("MASTER", "CORE", "TASK"):
+            groups["ig-{:04d}{}".format(c, group_type)] = (
+                group_type,
+                [r for r in records if r[4] == group_type],
+            )
+        result["j-{:08d}".format(c)] = groups
+    return result
+
+
+class PricingServer:
+    """
+    Serves a directory laid out like the pricing API over HTTP on localhost.
+    Like the real endpoint it answers with an ETag and a Last-Modified date,
+    honours If-None-Match and If-Modified-Since with 304 Not Modified and
+    gzips the bodies for clients accepting it.
+    """
+
+    def __init__(self, directory):
+        self.calls = collections.Counter()
+        self.bytes_sent = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = os.path.join(directory, self.path.split("?")[0].lstrip("/"))
+                if not os.path.isfile(path):
+                    server.calls["not_found"] += 1
+                    self.send_error(404)
+                    return
+                stat = os.stat(path)
+                etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+                last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+                if self.headers.get("If-None-Match") == etag:
+                    server.calls["not_modified"] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                server.calls["http_get"] += 1
+                with open(path, "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+                server.bytes_sent += len(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self._httpd.server_address[1])
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
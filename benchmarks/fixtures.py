@@ -0,0 +1,257 @@
+"""
+Synthetic fixtures shaped like the AWS responses the calculator consumes.
+
+They are deterministic for a given size so benchmark runs are comparable.
+"""
+
+import datetime
+import json
+import random
+
+from dateutil import tz
+
+OPERATING_SYSTEMS = ["Linux", "Windows", "RHEL", "SUSE"]
+TENANCIES = ["Shared", "Dedicated", "Host"]
+CAPACITY_STATUSES = [
+    "Used",
+    "UnusedCapacityReservation",
+    "AllocatedCapacityReservation",
+]
+
+
+def instance_type_name(index):
+    families = ["m5", "c5", "r5", "i3", "m6g", "c6g", "r6g", "x1"]
+    sizes = ["large", "xlarge", "2xlarge", "4xlarge", "8xlarge", "12xlarge"]
+    return "{}{}.{}".format(
+        families[index % len(families)],
+        "" if index < len(families) * len(sizes) else index,
+        sizes[(index // len(families)) % len(sizes)],
+    )
+
+
+def _on_demand_term(sku, price):
+    term_code = sku + ".JRTCKXETXF"
+    return {
+        term_code: {
+            "offerTermCode": "JRTCKXETXF",
+            "sku": sku,
+            "effectiveDate": "2024-01-01T00:00:00Z",
+            "priceDimensions": {
+                term_code
+                + ".6YS6EN2CT7": {
+                    "rateCode": term_code + ".6YS6EN2CT7",
+                    "description": "On Demand usage",
+                    "beginRange": "0",
+                    "endRange": "Inf",
+                    "unit": "Hrs",
+                    "pricePerUnit": {"USD": "{:.10f}".format(price)},
+                    "appliesTo": [],
+                }
+            },
+            "termAttributes": {},
+        }
+    }
+
+
+def _reserved_terms(sku, price):
+    terms = {}
+    for code in ("4NA7Y494T4", "6QCMYABX3D", "7NE97W5U4E", "HU7G6KETJZ"):
+        term_code = sku + "." + code
+        terms[term_code] = {
+            "offerTermCode": code,
+            "sku": sku,
+            "effectiveDate": "2024-01-01T00:00:00Z",
+            "priceDimensions": {
+                term_code
+                + ".2TG2D8R56U": {
+                    "rateCode": term_code + ".2TG2D8R56U",
+                    "description": "Upfront Fee",
+                    "unit": "Quantity",
+                    "pricePerUnit": {"USD": "{:.0f}".format(price * 5000)},
+                    "appliesTo": [],
+                }
+            },
+            "termAttributes": {
+                "LeaseContractLength": "1yr",
+                "OfferingClass": "standard",
+                "PurchaseOption": "All Upfront",
+            },
+        }
+    return terms
+
+
+def ec2_offer(products: int, seed: int = 0):
+    """
+    :param products: Number of SKUs in the offer
+    :return: An AmazonEC2 regional offer document
+    """
+    rng = random.Random(seed)
+    document = {
+        "formatVersion": "v1.0",
+        "disclaimer": "Synthetic offer file for benchmarks",
+        "offerCode": "AmazonEC2",
+        "version": "20240101000000",
+        "publicationDate": "2024-01-01T00:00:00Z",
+        "products": {},
+        "terms": {"OnDemand": {}, "Reserved": {}},
+    }
+    for i in range(products):
+        sku = "SKU{:012d}".format(i)
+        combination = i % (len(OPERATING_SYSTEMS) * len(TENANCIES) * 3)
+        attributes = {
+            "servicecode": "AmazonEC2",
+            "location": "US East (N. Virginia)",
+            "locationType": "AWS Region",
+            "instanceType": instance_type_name(
+                i // (len(OPERATING_SYSTEMS) * len(TENANCIES) * 3)
+            ),
+            "currentGeneration": "Yes",
+            "instanceFamily": "General purpose",
+            "vcpu": str(rng.choice([2, 4, 8, 16, 32])),
+            "physicalProcessor": "Intel Xeon Platinum 8175",
+            "clockSpeed": "3.1 GHz",
+            "memory": "{} GiB".format(rng.choice([8, 16, 32, 64])),
+            "storage": "EBS only",
+            "networkPerformance": "Up to 10 Gigabit",
+            "processorArchitecture": "64-bit",
+            "tenancy": TENANCIES[combination % len(TENANCIES)],
+            "operatingSystem": OPERATING_SYSTEMS[
+                (combination // len(TENANCIES)) % len(OPERATING_SYSTEMS)
+            ],
+            "licenseModel": "No License required",
+            "usagetype": "BoxUsage",
+            "operation": "RunInstances",
+            "capacitystatus": CAPACITY_STATUSES[
+                combination // (len(TENANCIES) * len(OPERATING_SYSTEMS))
+            ],
+            "preInstalledSw": "NA",
+            "regionCode": "us-east-1",
+        }
+        document["products"][sku] = {
+            "sku": sku,
+            "productFamily": "Compute Instance",
+            "attributes": attributes,
+        }
+        price = rng.uniform(0.01, 10)
+        document["terms"]["OnDemand"][sku] = _on_demand_term(sku, price)
+        document["terms"]["Reserved"][sku] = _reserved_terms(sku, price)
+    return document
+
+
+def emr_offer(instance_types: int, seed: int = 0):
+    """
+    :return: An ElasticMapReduce regional offer document
+    """
+    rng = random.Random(seed)
+    document = {
+        "formatVersion": "v1.0",
+        "offerCode": "ElasticMapReduce",
+        "products": {},
+        "terms": {"OnDemand": {}},
+    }
+    for i in range(instance_types):
+        sku = "EMRSKU{:08d}".format(i)
+        document["products"][sku] = {
+            "sku": sku,
+            "productFamily": "Elastic Map Reduce Instance",
+            "attributes": {
+                "servicecode": "ElasticMapReduce",
+                "instanceType": instance_type_name(i),
+                "softwareType": "EMR",
+            },
+        }
+        document["terms"]["OnDemand"][sku] = _on_demand_term(sku, rng.uniform(0.01, 1))
+    return document
+
+
+def write_json(path, document):
+    # the published offer files are indented with 4 spaces
+    with open(path, "w") as f:
+        json.dump(document, f, indent=4)
+
+
+def spot_price_history(start: float, end: float, seed: int = 0):
+    """
+    :return: A list of (epoch timestamp, price) spot price changes between
+            start and end, a few hours apart like the real ones
+    """
+    rng = random.Random(seed)
+    points = []
+    ts = start
+    while ts < end:
+        points.append((ts, round(rng.uniform(0.01, 0.5), 4)))
+        ts += rng.randrange(600, 6 * 3600)
+    return points
+
+
+def instance_records(count: int, start: float, span: float, seed: int = 0):
+    """
+    :param start: Epoch seconds of the earliest instance creation
+    :param span: Seconds over which the instances are created
+    :return: A list of (start, end, instance type, market, group type) tuples
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        created = start + rng.uniform(0, span)
+        group_type = rng.choice(["MASTER", "CORE", "TASK", "TASK"])
+        records.append(
+            (
+                created,
+                created + rng.uniform(300, 12 * 3600),
+                instance_type_name(rng.randrange(8)),
+                "SPOT" if group_type == "TASK" and rng.random() < 0.7 else "ON_DEMAND",
+                group_type,
+            )
+        )
+    return records
+
+
+def list_instances_page(records, group_id, marker, page_size, fleet=False):
+    """
+    Builds a list_instances response from instance_records tuples, with
+    datetimes and nested records like the ones boto3 returns
+    :param marker: Index of the first record of the page
+    """
+    instances = []
+    for i in range(marker, min(marker + page_size, len(records))):
+        start, end, instance_type, market, _ = records[i]
+        instances.append(
+            {
+                "Id": "ci-{:013d}".format(i),
+                "Ec2InstanceId": "i-{:017x}".format(i),
+                "PublicDnsName": "ec2-10-0-{}-{}.compute-1.amazonaws.com".format(
+                    i // 256 % 256, i % 256
+                ),
+                "PrivateDnsName": "ip-10-0-{}-{}.ec2.internal".format(
+                    i // 256 % 256, i % 256
+                ),
+                "PrivateIpAddress": "10.0.{}.{}".format(i // 256 % 256, i % 256),
+                "Status": {
+                    "State": "TERMINATED",
+                    "StateChangeReason": {"Code": "INSTANCE_FAILURE"},
+                    "Timeline": {
+                        "CreationDateTime": datetime.datetime.fromtimestamp(
+                            start, tz=tz.tzutc()
+                        ),
+                        "ReadyDateTime": datetime.datetime.fromtimestamp(
+                            start + 300, tz=tz.tzutc()
+                        ),
+                        "EndDateTime": datetime.datetime.fromtimestamp(
+                            end, tz=tz.tzutc()
+                        ),
+                    },
+                },
+                ("InstanceFleetId" if fleet else "InstanceGroupId"): group_id,
+                "Market": market,
+                "InstanceType": instance_type,
+                "EbsVolumes": [
+                    {"Device": "/dev/sdb", "VolumeId": "vol-{:017x}".format(2 * i)},
+                    {"Device": "/dev/sdc", "VolumeId": "vol-{:017x}".format(2 * i + 1)},
+                ],
+            }
+        )
+    response = {"Instances": instances}
+    if marker + page_size < len(records):
+        response["Marker"] = str(marker + page_size)
+    return response
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+"""Benchmark suite for the calculator hot paths
+
+Runs every stage offline against synthetic fixtures (or a recorded offer
+file and response archive) and reports its wall time, peak memory and API
+calls. With --compare the suite is also run against another commit and both
+are shown side by side.
+
+Usage:
+    run.py [options] [--stage=<name>...]
+    run.py -h | --help
+
+Options:
+    -h --help             Show this screen
+    --stage=<name>        Only run the given stages (offer_parsing, pricing,
+    pricing_revalidation, spot_billing, cluster_cost, fleet_cost, total_cost,
+    replay)
+    --products=<n>        SKUs of the synthetic EC2 offer file [default: 5000]
+    --offer_file=<path>   Recorded EC2 offer file to use instead
+    --archive=<path>      Response archive saved with --capture, replayed by
+    the replay stage instead of a capture of the total_cost clusters
+    --instances=<n>       Instances of the cluster_cost and fleet_cost clusters
+    [default: 20000]
+    --clusters=<n>        Clusters of the total_cost stage [default: 50]
+    --cluster_instances=<n>  Instances per cluster of the total_cost stage
+    [default: 200]
+    --spot_queries=<n>    Billing queries of the spot_billing stage
+    [default: 20000]
+    --spot_interval=<s>   Average seconds between spot price changes
+    [default: 3600]
+    --repeat=<n>          Timing runs per stage, the fastest is kept
+    [default: 3]
+    --output=<path>       Write the results as JSON
+    --compare=<rev>       Also run the suite against this git revision
+    --source=<dir>        Benchmark the calculator package found in this
+    directory instead of the one of this checkout
+"""
+
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dateutil import tz  # noqa: E402
+from docopt import docopt  # noqa: E402
+
+from benchmarks import fake_aws, fixtures  # noqa: E402
+
+STAGES = [
+    "offer_parsing",
+    "pricing",
+    "pricing_revalidation",
+    "spot_billing",
+    "cluster_cost",
+    "fleet_cost",
+    "total_cost",
+    "replay",
+]
+REGION = "us-east-1"
+START = datetime.datetime(2024, 1, 1, tzinfo=tz.tzutc()).timestamp()
+SPAN = 30 * 24 * 3600
+INSTANCE_TYPES = [fixtures.instance_type_name(i) for i in range(8)]
+
+
+class Fixtures:
+    """
+    Lazily written fixture files shared by the stages
+    """
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self._offer_dir = None
+
+    @property
+    def offer_dir(self):
+        """
+        A directory laid out like the pricing API, with the index files and
+        the EC2 and EMR offer files of one region
+        """
+        if self._offer_dir is None:
+            offer_dir = os.path.join(self.workdir, "offers")
+            base = os.path.join(offer_dir, "offers", "v1.0", "aws")
+            index = {"offers": {}}
+            for offer_code in ("AmazonEC2", "ElasticMapReduce"):
+                version_url = "/offers/v1.0/aws/{}/20240101/{}/index.json".format(
+                    offer_code, REGION
+                )
+                region_index_url = "/offers/v1.0/aws/{}/current/region_index.json"
+                region_index_url = region_index_url.format(offer_code)
+                index["offers"][offer_code] = {
+                    "currentRegionIndexUrl": region_index_url
+                }
+                os.makedirs(os.path.join(base, offer_code, "current"))
+                os.makedirs(os.path.join(base, offer_code, "20240101", REGION))
+                fixtures.write_json(
+                    offer_dir + region_index_url,
+                    {"regions": {REGION: {"currentVersionUrl": version_url}}},
+                )
+                if offer_code == "AmazonEC2" and self.args["--offer_file"]:
+                    shutil.copy(self.args["--offer_file"], offer_dir + version_url)
+                elif offer_code == "AmazonEC2":
+                    fixtures.write_json(
+                        offer_dir + version_url,
+                        fixtures.ec2_offer(int(self.args["--products"])),
+                    )
+                else:
+                    fixtures.write_json(
+                        offer_dir + version_url, fixtures.emr_offer(len(INSTANCE_TYPES))
+                    )
+            fixtures.write_json(os.path.join(base, "index.json"), index)
+            self._offer_dir = offer_dir
+        return self._offer_dir
+
+    @property
+    def ec2_offer_file(self):
+        return os.path.join(
+            self.offer_dir,
+            "offers/v1.0/aws/AmazonEC2/20240101/{}/index.json".format(REGION),
+        )
+
+
+def _spot_pricing(interval):
+    from calculator.calculator import SpotPricing
+    from calculator.rate_limit import RateLimiter
+
+    # the fake clients are never throttled, so the calls are not limited
+    spot_pricing = SpotPricing(region=REGION, rate_limiter=RateLimiter())
+    spot_pricing.client_ec2 = fake_aws.FakeEc2Client(interval=interval)
+    return spot_pricing
+
+
+def _calculator(args, clusters, fleets=False, **kwargs):
+    from calculator.calculator import Ec2EmrPricing, EmrCostCalculator
+    from calculator.rate_limit import RateLimiter
+
+    pricing = Ec2EmrPricing.from_prices(
+        REGION,
+        {t: 0.1 * (i + 1) for i, t in enumerate(INSTANCE_TYPES)},
+        {t: 0.02 * (i + 1) for i, t in enumerate(INSTANCE_TYPES)},
+    )
+    return EmrCostCalculator(
+        region=REGION,
+        emr_client=fake_aws.FakeEmrClient(clusters, fleets=fleets),
+        spot_pricing=_spot_pricing(int(args["--spot_interval"])),
+        ec2_emr_pricing=pricing,
+        rate_limiter=RateLimiter(),
+        **kwargs
+    )
+
+
+def _calls(*clients):
+    calls = {}
+    for client in clients:
+        calls.update(client.calls)
+    return calls
+
+
+def setup_offer_parsing(args, data):
+    from calculator import offer_parser
+
+    path = data.ec2_offer_file
+
+    def run():
+        offer_parser.parse_ec2_offer(offer_parser.iter_file_chunks(path))
+        return {}
+
+    return run
+
+
+def setup_pricing(args, data):
+    from calculator.calculator import Ec2EmrPricing
+
+    server = fake_aws.PricingServer(data.offer_dir)
+    LocalPricing = type("LocalPricing", (Ec2EmrPricing,), {"url_base": server.url})
+
+    def run():
+        server.calls.clear()
+        # the price tables are loaded on the first lookup
+        LocalPricing(region=REGION).ec2_prices
+        return dict(server.calls)
+
+    run.close = server.close
+    return run
+
+
+def setup_pricing_revalidation(args, data):
+    """
+    Loads the pricing again with a warm cache, the price lists being
+    unchanged on the server
+    """
+    from calculator.calculator import Ec2EmrPricing
+    from calculator.pricing_cache import PricingCache
+
+    server = fake_aws.PricingServer(data.offer_dir)
+    LocalPricing = type("LocalPricing", (Ec2EmrPricing,), {"url_base": server.url})
+    cache_dir = tempfile.mkdtemp()
+    cache = PricingCache(cache_dir=cache_dir)
+    LocalPricing(region=REGION, cache=cache).ec2_prices
+
+    def run():
+        server.calls.clear()
+        LocalPricing(region=REGION, cache=cache).ec2_prices
+        return dict(server.calls)
+
+    def close():
+        server.close()
+        shutil.rmtree(cache_dir)
+
+    run.close = close
+    return run
+
+
+def setup_spot_billing(args, data):
+    rng = random.Random(0)
+    queries = []
+    for _ in range(int(args["--spot_queries"])):
+        start = START + rng.uniform(0, SPAN)
+        queries.append(
+            (
+                rng.choice(INSTANCE_TYPES),
+                datetime.datetime.fromtimestamp(start, tz=tz.tzutc()),
+                datetime.datetime.fromtimestamp(
+                    start + rng.uniform(300, 86400), tz=tz.tzutc()
+                ),
+            )
+        )
+
+    def run():
+        spot_pricing = _spot_pricing(int(args["--spot_interval"]))
+        for instance_type, start, end in queries:
+            spot_pricing.get_billed_price_for_period(
+                instance_type, fake_aws.AVAILABILITY_ZONE, start, end
+            )
+        return _calls(spot_pricing.client_ec2)
+
+    return run
+
+
+def setup_cluster_cost(args, data):
+    clusters = fake_aws.synthetic_clusters(1, int(args["--instances"]), START, SPAN)
+    cluster_id = next(iter(clusters))
+
+    def run():
+        calculator = _calculator(args, clusters)
+        calculator.get_cluster_cost(cluster_id)
+        return _calls(calculator.conn, calculator.spot_pricing.client_ec2)
+
+    return run
+
+
+def setup_fleet_cost(args, data):
+    """
+    A single cluster made of instance fleets mixing every instance type
+    """
+    clusters = fake_aws.synthetic_clusters(1, int(args["--instances"]), START, SPAN)
+    cluster_id = next(iter(clusters))
+
+    def run():
+        calculator = _calculator(args, clusters, fleets=True)
+        calculator.get_cluster_cost(cluster_id)
+        return _calls(calculator.conn, calculator.spot_pricing.client_ec2)
+
+    return run
+
+
+def setup_total_cost(args, data):
+    clusters = fake_aws.synthetic_clusters(
+        int(args["--clusters"]), int(args["--cluster_instances"]), START, SPAN
+    )
+
+    def run():
+        calculator = _calculator(args, clusters)
+        calculator.get_total_cost_by_dates(
+            datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 1)
+        )
+        return _calls(calculator.conn, calculator.spot_pricing.client_ec2)
+
+    return run
+
+
+def setup_replay(args, data):
+    """
+    Loads a response archive and costs again every period listed in it
+    """
+    from calculator.archive import ResponseArchive
+    from calculator.calculator import EmrCostCalculator
+
+    path = args["--archive"]
+    if not path:
+        clusters = fake_aws.synthetic_clusters(
+            int(args["--clusters"]), int(args["--cluster_instances"]), START, SPAN
+        )
+        calculator = _calculator(args, clusters, capture=ResponseArchive(REGION))
+        calculator.get_total_cost_by_dates(
+            datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 1)
+        )
+        path = os.path.join(data.workdir, "archive.json.gz")
+        calculator.save_archive(path)
+
+    def run():
+        archive = ResponseArchive.load(path)
+        calculator = EmrCostCalculator(replay=archive)
+        for created_after, created_before in archive.periods():
+            calculator.get_total_cost_by_dates(created_after, created_before)
+        return _calls(calculator.conn, calculator.spot_pricing.client_ec2)
+
+    return run
+
+
+def measure(stage, args, data):
+    setup = globals()["setup_" + stage]
+    result = {"stage": stage}
+    try:
+        run = setup(args, data)
+        wall_times = []
+        for _ in range(int(args["--repeat"])):
+            started = time.perf_counter()
+            calls = run()
+            wall_times.append(time.perf_counter() - started)
+        result["wall_time"] = min(wall_times)
+        result["calls"] = calls
+
+        tracemalloc.start()
+        run()
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if hasattr(run, "close"):
+            run.close()
+    except Exception as e:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def run_suite(args):
+    stages = args["--stage"] or STAGES
+    workdir = tempfile.mkdtemp()
+    try:
+        data = Fixtures(args, workdir)
+        return [measure(stage, args, data) for stage in stages]
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _format(result):
+    if "error" in result:
+        return "error: " + result["error"][:31]
+    return "{:8.3f}s {:9.1f} MB {:7d} calls".format(
+        result["wall_time"],
+        result["peak_memory"] / 1024.0 / 1024.0,
+        sum(result["calls"].values()),
+    )
+
+
+def print_results(results):
+    for result in results:
+        print("{:20s} {}".format(result["stage"], _format(result)))
+
+
+def print_comparison(revision, base_results, results):
+    print("{:20s} {:38s} {:38s} {}".format("", revision, "current", "time"))
+    base = {r["stage"]: r for r in base_results}
+    for result in results:
+        base_result = base.get(result["stage"], {"error": "not run"})
+        change = ""
+        if "wall_time" in result and "wall_time" in base_result:
+            change = "{:+.0f}%".format(
+                100.0 * (result["wall_time"] / base_result["wall_time"] - 1)
+            )
+        print(
+            "{:20s} {:38s} {:38s} {}".format(
+                result["stage"], _format(base_result), _format(result), change
+            )
+        )
+
+
+def run_revision(revision, argv):
+    """
+    Runs this suite against the calculator of another revision, checked
+    out in a temporary git worktree
+    :return: The results of that run
+    """
+    workdir = tempfile.mkdtemp()
+    worktree = os.path.join(workdir, "tree")
+    output = os.path.join(workdir, "results.json")
+    subprocess.check_call(
+        ["git", "-C", ROOT, "worktree", "add", "--detach", worktree, revision],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        subprocess.check_call(
+            [sys.executable, os.path.abspath(__file__)]
+            + argv
+            + ["--source=" + worktree, "--output=" + output]
+        )
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        subprocess.check_call(
+            ["git", "-C", ROOT, "worktree", "remove", "--force", worktree]
+        )
+        shutil.rmtree(workdir)
+
+
+def main():
+    args = docopt(__doc__)
+    if args["--source"]:
+        sys.path.insert(0, os.path.abspath(args["--source"]))
+
+    if args["--compare"]:
+        argv = [
+            a
+            for a in sys.argv[1:]
+            if not a.startswith(("--compare", "--output", "--source"))
+        ]
+        base_results = run_revision(args["--compare"], argv)
+        results = run_suite(args)
+        print_comparison(args["--compare"], base_results, results)
+    else:
+        results = run_suite(args)
+        if not args["--source"]:
+            print_results(results)
+
+    if args["--output"]:
+        with open(args["--output"], "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Archive of the AWS responses of a run, to cost it again without the network.
+
+While capturing, the EMR and EC2 clients are wrapped so that every response
+of the operations the calculator uses is kept, together with the price
+tables it looked up. The archive is written as gzipped JSON lines:
+
+    header       format, version, region and capture time
+    prices       the reduced EC2 on demand and EMR price tables
+    response     one per EMR call, keyed by its operation and parameters
+    spot         the spot price points of an (instance type, AZ)
+
+Replaying answers the same EMR calls from the archive and serves the spot
+price history of any period from the recorded points, so
+get_cluster_cost, get_total_cost_by_dates and rollups of the captured
+clusters run at CPU speed, e.g. to cost past months again after a change
+of the pricing logic. Instances still running when the archive was captured
+are billed until the capture time, so every replay gives the same costs.
+"""
+
+import bisect
+import collections
+import copy
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from dateutil import tz
+
+from calculator.ledger import to_epoch
+
+FORMAT = "emr-cost-archive"
+FORMAT_VERSION = 1
+
+# the operations captured per service
+OPERATIONS = {
+    "emr": (
+        "list_clusters",
+        "describe_cluster",
+        "list_instance_groups",
+        "list_instance_fleets",
+        "list_instances",
+    ),
+    "ec2": ("describe_spot_price_history",),
+}
+
+# datetimes are stored as {"$t": epoch seconds}
+_TIME_KEY = "$t"
+
+
+class ArchiveError(ValueError):
+    """
+    Raised when a file is not an archive this version can read
+    """
+
+
+class MissingResponseError(LookupError):
+    """
+    Raised when a replayed call was not captured
+    """
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {_TIME_KEY: to_epoch(value)}
+    raise TypeError("{!r} can not be archived".format(value))
+
+
+def _decode(value):
+    if len(value) == 1 and _TIME_KEY in value:
+        return datetime.datetime.fromtimestamp(value[_TIME_KEY], tz=tz.tzutc())
+    return value
+
+
+def _call_key(operation, params):
+    return operation, json.dumps(params, sort_keys=True, default=_encode)
+
+
+class RecordingClient:
+    """
+    Wraps a boto3 client, adding the responses of the captured operations
+    to an archive. Other attributes are passed through to the client.
+    """
+
+    def __init__(self, client, archive: "ResponseArchive", service: str):
+        self._client = client
+        self._archive = archive
+        self._operations = OPERATIONS[service]
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._operations:
+            return attribute
+
+        def call(**kwargs):
+            response = attribute(**kwargs)
+            self._archive.add(name, kwargs, response)
+            return response
+
+        return call
+
+
+class ReplayClient:
+    """
+    Stands in for a boto3 client, answering the captured operations from an
+    archive and counting the calls made to every operation
+    """
+
+    def __init__(self, archive: "ResponseArchive", service: str):
+        self._archive = archive
+        self._operations = OPERATIONS[service]
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._operations:
+            raise AttributeError(name)
+
+        def call(**kwargs):
+            with self._lock:
+                self.calls[name] += 1
+            if name == "describe_spot_price_history":
+                return self._archive.spot_price_history(**kwargs)
+            return self._archive.lookup(name, kwargs)
+
+        return call
+
+
+class ResponseArchive:
+    """
+    The responses captured during a run, in memory. Thread safe while
+    capturing.
+    """
+
+    def __init__(self, region: typing.Optional[str] = None):
+        self.region = region
+        self.captured_at = time.time()
+        self.ec2_prices = {}
+        self.emr_prices = {}
+        # (operation, json parameters) -> response
+        self._responses = {}
+        # (instance type, AZ) -> {epoch timestamp: spot price}
+        self._spot_points = {}
+        self._spot_timestamps = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def record(self, client, service: str) -> RecordingClient:
+        """
+        :param service: emr or ec2
+        :return: The client, wrapped to capture its responses here
+        """
+        return RecordingClient(client, self, service)
+
+    def client(self, service: str) -> ReplayClient:
+        """
+        :param service: emr or ec2
+        :return: A client answering from this archive
+        """
+        return ReplayClient(self, service)
+
+    def add(self, operation: str, params: dict, response: dict):
+        if operation == "describe_spot_price_history":
+            key = (params["InstanceTypes"][0], params["AvailabilityZone"])
+            with self._lock:
+                points = self._spot_points.setdefault(key, {})
+                for price in response["SpotPriceHistory"]:
+                    points[price["Timestamp"].timestamp()] = price["SpotPrice"]
+                self._spot_timestamps.pop(key, None)
+            return
+        # the request metadata is different for every call and never used
+        response = copy.deepcopy(
+            {k: v for k, v in response.items() if k != "ResponseMetadata"}
+        )
+        # encoded now, as the caller may reuse the parameters for the next page
+        key = _call_key(operation, params)
+        with self._lock:
+            self._responses[key] = response
+
+    def set_prices(
+        self,
+        ec2_prices: typing.Mapping[str, float],
+        emr_prices: typing.Mapping[str, float],
+    ):
+        with self._lock:
+            self.ec2_prices = dict(ec2_prices)
+            self.emr_prices = dict(emr_prices)
+
+    def lookup(self, operation: str, params: dict) -> dict:
+        """
+        :return: The captured response of a call
+        """
+        response = self._responses.get(_call_key(operation, params))
+        if response is None:
+            raise MissingResponseError(
+                "{} {} is not in the archive".format(
+                    operation, json.dumps(params, sort_keys=True, default=_encode)
+                )
+            )
+        if operation == "list_instances":
+            # still running when captured: billed until then
+            captured_at = datetime.datetime.fromtimestamp(
+                self.captured_at, tz=tz.tzutc()
+            )
+            for instance in response["Instances"]:
+                instance["Status"]["Timeline"].setdefault("EndDateTime", captured_at)
+        return response
+
+    def spot_price_history(
+        self, InstanceTypes, AvailabilityZone, StartTime, EndTime, **kwargs
+    ) -> dict:
+        """
+        :return: A describe_spot_price_history response with every captured
+                point of the period and the price in effect at its start,
+                newest first and in a single page
+        """
+        key = (InstanceTypes[0], AvailabilityZone)
+        with self._lock:
+            points = self._spot_points.get(key)
+            if points is None:
+                raise MissingResponseError(
+                    "No spot price of {} in {} is in the archive".format(*key)
+                )
+            timestamps = self._spot_timestamps.get(key)
+            if timestamps is None:
+                timestamps = sorted(points)
+                self._spot_timestamps[key] = timestamps
+        first = max(0, bisect.bisect_right(timestamps, StartTime.timestamp()) - 1)
+        last = bisect.bisect_right(timestamps, EndTime.timestamp())
+        return {
+            "SpotPriceHistory": [
+                {
+                    "AvailabilityZone": AvailabilityZone,
+                    "InstanceType": InstanceTypes[0],
+                    "ProductDescription": "Linux/UNIX (Amazon VPC)",
+                    "SpotPrice": points[ts],
+                    "Timestamp": datetime.datetime.fromtimestamp(ts, tz=tz.tzutc()),
+                }
+                for ts in reversed(timestamps[first:last])
+            ],
+            "NextToken": "",
+        }
+
+    def periods(self) -> typing.List[typing.Tuple[datetime.datetime, ...]]:
+        """
+        :return: The (created_after, created_before) periods whose clusters
+                were listed, as naive UTC datetimes
+        """
+        periods = []
+        for operation, params in sorted(self._responses):
+            params = json.loads(params, object_hook=_decode)
+            if operation == "list_clusters" and "Marker" not in params:
+                periods.append(
+                    (
+                        params["CreatedAfter"].replace(tzinfo=None),
+                        params["CreatedBefore"].replace(tzinfo=None),
+                    )
+                )
+        return periods
+
+    def save(self, path: str):
+        """
+        Atomically writes the archive to a gzipped JSON lines file
+        """
+        with self._lock:
+            responses = list(self._responses.items())
+            spot_points = list(self._spot_points.items())
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+                for record in [
+                    {
+                        "format": FORMAT,
+                        "version": FORMAT_VERSION,
+                        "region": self.region,
+                        "captured_at": self.captured_at,
+                    },
+                    {"prices": {"ec2": self.ec2_prices, "emr": self.emr_prices}},
+                ]:
+                    f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                for (operation, params), response in sorted(responses):
+                    # the parameters are kept as the key of the call
+                    record = {
+                        "operation": operation,
+                        "params": params,
+                        "response": response,
+                    }
+                    f.write(
+                        json.dumps(record, separators=(",", ":"), default=_encode)
+                        + "\n"
+                    )
+                for (instance_type, zone), points in sorted(spot_points):
+                    record = {
+                        "spot": [instance_type, zone],
+                        "points": sorted(points.items()),
+                    }
+                    f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "ResponseArchive":
+        archive = cls()
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("format") != FORMAT:
+                    raise ArchiveError("{} is not a response archive".format(path))
+                if header.get("version") != FORMAT_VERSION:
+                    raise ArchiveError(
+                        "{} has archive format {}, expected {}".format(
+                            path, header.get("version"), FORMAT_VERSION
+                        )
+                    )
+                archive.region = header["region"]
+                archive.captured_at = header["captured_at"]
+                for line in f:
+                    record = json.loads(line, object_hook=_decode)
+                    if "prices" in record:
+                        archive.ec2_prices = record["prices"]["ec2"]
+                        archive.emr_prices = record["prices"]["emr"]
+                    elif "spot" in record:
+                        archive._spot_points[tuple(record["spot"])] = dict(
+                            record["points"]
+                        )
+                    else:
+                        key = record["operation"], record["params"]
+                        archive._responses[key] = record["response"]
+        except (OSError, EOFError, ValueError) as e:
+            if isinstance(e, ArchiveError):
+                raise
+            raise ArchiveError("{} can not be read: {}".format(path, e))
+        return archive
@@ -0,0 +1,173 @@
+"""
+asyncio flavour of EmrCostCalculator.
+
+boto3 clients are blocking, so every API call runs on a thread pool owned by
+the calculator while asyncio schedules the independent calls of a cluster
+(describe_cluster, the list_instances pagination of each instance group and
+the spot price history of each instance type) and of different clusters
+concurrently. The costs themselves are computed by the same code as
+EmrCostCalculator, so both produce the same cost_dict.
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import sys
+import typing
+
+from calculator.calculator import EmrCostCalculator
+from calculator.pricing_cache import PricingCache
+from calculator.rate_limit import DEFAULT_RATE_LIMITS, RateLimiter
+
+
+class AsyncEmrCostCalculator:
+    def __init__(
+        self,
+        region: str = None,
+        pricing_cache: typing.Optional[PricingCache] = None,
+        offline: bool = False,
+        max_concurrency: int = 16,
+        rate_limits: typing.Optional[typing.Dict[str, float]] = None,
+        endpoint_url: typing.Optional[str] = None,
+        instrumentation=None,
+    ):
+        """
+        :param max_concurrency: Maximum number of API calls in flight
+        :param rate_limits: Requests per second per API operation, overriding
+                DEFAULT_RATE_LIMITS
+        :param endpoint_url: Optional endpoint of the EMR and EC2 APIs, e.g.
+                a local stub server
+        :param instrumentation: Optional Instrumentation, see EmrCostCalculator
+        """
+        rates = dict(DEFAULT_RATE_LIMITS)
+        rates.update(rate_limits or {})
+        self.calculator = EmrCostCalculator(
+            region=region,
+            pricing_cache=pricing_cache,
+            offline=offline,
+            endpoint_url=endpoint_url,
+            instrumentation=instrumentation,
+            rate_limiter=RateLimiter(rates, instrumentation=instrumentation),
+        )
+
+        self.max_concurrency = max_concurrency
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency
+        )
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def get_total_cost_by_dates(self, created_after, created_before):
+        calculator = self.calculator
+        cluster_ids = await self._run(
+            lambda: list(calculator._get_cluster_list(created_after, created_before))
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def get_cost(cluster_id):
+            async with semaphore:
+                return await self.get_cluster_cost(cluster_id)
+
+        cost_dicts = await asyncio.gather(*[get_cost(c) for c in cluster_ids])
+
+        total_cost = 0
+        for cluster_id, cost_dict in zip(cluster_ids, cost_dicts):
+            if "TOTAL" in cost_dict:
+                total_cost += cost_dict["TOTAL"]
+            else:
+                print(
+                    "[INFO] Cluster {} has no cost associated with it".format(
+                        cluster_id
+                    ),
+                    file=sys.stderr,
+                )
+        return total_cost
+
+    async def get_cluster_cost(
+        self,
+        cluster_id: str,
+        start_date: typing.Optional[datetime.datetime] = None,
+        end_date: typing.Optional[datetime.datetime] = None,
+    ):
+        """
+        Same as EmrCostCalculator.get_cluster_cost
+        """
+        calculator = self.calculator
+        cluster_info = await self._run(calculator._get_cluster_info, cluster_id)
+        if cluster_info.never_ran:
+            return {}
+        availability_zone = cluster_info.availability_zone
+        instance_groups, fleet = await self._run(
+            calculator._get_instance_groups_or_fleets, cluster_id
+        )
+        instance_lists = await asyncio.gather(
+            *[
+                self._run(
+                    lambda group: list(
+                        calculator._get_instances(
+                            group, cluster_id, start_date, end_date, fleet
+                        )
+                    ),
+                    instance_group,
+                )
+                for instance_group in instance_groups
+            ]
+        )
+        await self._prefetch_spot_prices(availability_zone, instance_lists)
+        return await self._run(
+            self._sum_costs, instance_groups, instance_lists, availability_zone, fleet
+        )
+
+    async def _prefetch_spot_prices(self, availability_zone, instance_lists):
+        """
+        Fetches the spot price history of every instance type used as a spot
+        instance, one concurrent request chain per type covering the whole
+        period all its instances ran
+        """
+        periods = {}
+        for instances in instance_lists:
+            for instance in instances:
+                if instance.market_type != "SPOT":
+                    continue
+                start, end = periods.get(
+                    instance.instance_type,
+                    (instance.creation_ts, instance.termination_ts),
+                )
+                periods[instance.instance_type] = (
+                    min(start, instance.creation_ts),
+                    max(end, instance.termination_ts),
+                )
+        spot_pricing = self.calculator.spot_pricing
+        await asyncio.gather(
+            *[
+                self._run(
+                    spot_pricing.prefetch, instance_type, availability_zone, start, end
+                )
+                for instance_type, (start, end) in periods.items()
+            ]
+        )
+
+    def _sum_costs(self, instance_groups, instance_lists, availability_zone, fleet):
+        """
+        Prices the listed instances like EmrCostCalculator.get_cluster_cost
+        """
+        cost_dict: typing.Dict[str, float] = {}
+        for instance_group, instances in zip(instance_groups, instance_lists):
+            if fleet:
+                self.calculator._add_fleet_cost(
+                    cost_dict, instance_group, instances, availability_zone
+                )
+                continue
+            for instance in instances:
+                self.calculator._add_instance_cost(
+                    cost_dict, instance_group, instance, availability_zone
+                )
+        return cost_dict
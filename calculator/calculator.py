@@ -1,13 +1,35 @@
 from __future__ import print_function
 
-import boto3
-from retrying import retry
 import sys
+import threading
 import typing
+import collections
+import concurrent.futures
 import datetime
-import requests
+import functools
+import os
+import tempfile
+import time
 from dateutil import tz
 
+from calculator.archive import ResponseArchive
+from calculator.batch import InstanceBatch, compute_batch_cost, spot_periods
+from calculator.cost_cache import ClusterCostCache
+from calculator.http_session import bytes_received, get_session
+from calculator.instrumentation import NULL_INSTRUMENTATION
+from calculator.ledger import TERMINAL_STATES, CostLedger
+from calculator.offer_parser import (
+    CHUNK_SIZE,
+    iter_file_chunks,
+    parse_ec2_offer,
+    parse_emr_offer,
+)
+from calculator.pricing_cache import PricingCache
+from calculator.rate_limit import DEFAULT_RATE_LIMITS, RateLimiter
+from calculator.rollup import BUCKET_SECONDS, CostRollup
+from calculator.snapshot import PriceSnapshot, write_snapshot
+from calculator.spot_series import SpotPriceSeries
+
 
 def validate_date(date_text):
     if not date_text:
@@ -18,20 +40,40 @@ def validate_date(date_text):
         raise ValueError("Incorrect data format, should be YYYY-MM-DD")
 
 
-def is_error_retriable(exception):
+# what is known about this many clusters (their describe_cluster result and
+# API calls) is remembered at least, more if the cost cache is larger
+MIN_CLUSTER_INFO_SIZE = 4096
+
+
+def default_region():
     """
-    Use this function in order to back off only
-    if error is retriable
+    :return: The region of the default boto3 session
     """
-    # TODO verify if this is correct way to handle this. Haven't seen errors
-    # TODO like this myself
-    try:
-        return exception.response["Error"]["Code"].startswith("5")
-    except AttributeError:
-        return False
+    import boto3
+
+    return boto3.session.Session().region_name
+
+
+def create_client(service, region, endpoint_url=None):
+    """
+    Creates a boto3 client, importing boto3 only when a client is needed
+    """
+    import boto3
+
+    return boto3.client(service, region_name=region, endpoint_url=endpoint_url)
 
 
 class Ec2Instance:
+    # a cluster can go through tens of thousands of instances, so records
+    # carry no per-instance __dict__
+    __slots__ = (
+        "creation_ts",
+        "termination_ts",
+        "instance_type",
+        "market_type",
+        "ebs_volumes",
+    )
+
     def __init__(
         self, creation_ts, termination_ts, instance_type, market_type, ebs_volumes
     ):
@@ -45,114 +87,357 @@ class Ec2Instance:
 
 
 class InstanceGroup:
+    __slots__ = ("group_id", "instance_type", "group_type", "disk_size")
+
     def __init__(self, group_id, instance_type, group_type, disk_size=[]):
         self.group_id = group_id
         self.instance_type = instance_type
         self.group_type = group_type
         self.disk_size = disk_size
 
+    def ebs_size_gb(self, instance_type):
+        """
+        :return: Total size of the EBS volumes of an instance of the group,
+                which all have the same instance type
+        """
+        return sum(ebs["VolumeSpecification"]["SizeInGB"] for ebs in self.disk_size)
 
-class Ec2EmrPricing:
-    def __init__(self, region: str = None):
-        if region is None:
-            my_session = boto3.session.Session()
-            region = my_session.region_name
-        url_base = "https://pricing.us-east-1.amazonaws.com"
 
-        index_response = requests.get(url_base + "/offers/v1.0/aws/index.json")
-        index = index_response.json()
+class InstanceFleet:
+    """
+    An instance fleet, whose instances can be of any of the instance types
+    of its specifications, each with its own EBS volumes
+    """
 
-        emr_regions_response = requests.get(
-            url_base + index["offers"]["ElasticMapReduce"]["currentRegionIndexUrl"]
-        )
-        emr_region_url = (
-            url_base
-            + emr_regions_response.json()["regions"][region]["currentVersionUrl"]
+    __slots__ = ("group_id", "group_type", "ebs_sizes")
+
+    def __init__(self, group_id, group_type, specifications):
+        """
+        :param specifications: The InstanceTypeSpecifications of the fleet
+        """
+        self.group_id = group_id
+        self.group_type = group_type
+        # instance type -> total size of the EBS volumes of its instances
+        self.ebs_sizes = {
+            spec["InstanceType"]: sum(
+                ebs["VolumeSpecification"]["SizeInGB"]
+                for ebs in spec.get("EbsBlockDevices", ())
+            )
+            for spec in specifications
+        }
+
+    def ebs_size_gb(self, instance_type):
+        """
+        :return: Total size of the EBS volumes of an instance of the fleet
+                with the given type, 0 for a type it has no specification of
+        """
+        return self.ebs_sizes.get(instance_type, 0)
+
+
+class ClusterInfo:
+    """
+    What the calculator needs to know about a cluster before pricing it
+    """
+
+    __slots__ = (
+        "cluster_id",
+        "availability_zone",
+        "collection_type",
+        "state",
+        "normalized_instance_hours",
+    )
+
+    def __init__(
+        self,
+        cluster_id,
+        availability_zone=None,
+        collection_type=None,
+        state=None,
+        normalized_instance_hours=None,
+    ):
+        self.cluster_id = cluster_id
+        self.availability_zone = availability_zone
+        self.collection_type = collection_type
+        self.state = state
+        self.normalized_instance_hours = normalized_instance_hours
+
+    @property
+    def is_fleet(self):
+        return self.collection_type == "INSTANCE_FLEET"
+
+    @property
+    def never_ran(self):
+        """
+        True for a terminated cluster that never had an instance running,
+        which can be skipped without any further API call
+        """
+        return (
+            self.state in ("TERMINATED", "TERMINATED_WITH_ERRORS")
+            and self.normalized_instance_hours == 0
         )
 
-        emr_pricing = requests.get(emr_region_url).json()
-        sku_to_instance_type = {}
-        for sku in emr_pricing["products"]:
-            if (
-                "softwareType" in emr_pricing["products"][sku]["attributes"].keys()
-            ) and (emr_pricing["products"][sku]["attributes"]["softwareType"] == "EMR"):
-                sku_to_instance_type[sku] = emr_pricing["products"][sku]["attributes"][
-                    "instanceType"
-                ]
 
-        self.emr_prices = {}
-        for sku in sku_to_instance_type.keys():
-            instance_type = sku_to_instance_type.get(sku)
-            sku_info = emr_pricing["terms"]["OnDemand"][sku]
-            if len(sku_info) > 1:
-                print(
-                    "[ERROR] More than one SKU for {}".format(sku_info), file=sys.stderr
+class Ec2EmrPricing:
+    url_base = "https://pricing.us-east-1.amazonaws.com"
+    index_path = "/offers/v1.0/aws/index.json"
+
+    def __init__(
+        self,
+        region: str = None,
+        cache: typing.Optional[PricingCache] = None,
+        offline: bool = False,
+        instrumentation=None,
+        index: typing.Optional[dict] = None,
+        parse_workers: int = 1,
+        download_dir: typing.Optional[str] = None,
+    ):
+        """
+        :param cache: Optional on-disk cache of the reduced price tables
+        :param offline: If set, a cached price table that has not expired is
+                used without contacting the pricing API at all
+        :param instrumentation: Optional Instrumentation recording the
+                requests, downloaded bytes and cache hits
+        :param index: Optional offer index already fetched with
+                get_offer_index, so that the pricing of several regions
+                fetches it only once
+        :param parse_workers: Number of processes parsing a downloaded offer
+                file
+        :param download_dir: Directory where the offer files are written
+                while they are downloaded, the system one by default
+        """
+        if region is None:
+            region = default_region()
+        self.region = region
+        self.cache = cache
+        self.offline = offline
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self._index = index
+        self._index_lock = threading.Lock()
+        self.parse_workers = parse_workers
+        self.download_dir = download_dir
+        # the price tables are only loaded when a price is first looked up
+        self._emr_prices = None
+        self._ec2_prices = None
+        self._prices_lock = threading.Lock()
+
+    def _load_prices(self):
+        with self._prices_lock:
+            if self._emr_prices is not None and self._ec2_prices is not None:
+                return
+            # the EMR and EC2 offers are downloaded in parallel
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                emr_prices = executor.submit(
+                    self._get_prices, "ElasticMapReduce", parse_emr_offer
                 )
-                sys.exit(1)
-            _, sku_info_value = sku_info.popitem()
-            price_dimensions = sku_info_value["priceDimensions"]
-            if len(sku_info) > 1:
-                print(
-                    "[ERROR] More than price dimension for {}".format(price_dimensions),
-                    file=sys.stderr,
+                ec2_prices = executor.submit(
+                    self._get_prices, "AmazonEC2", parse_ec2_offer
                 )
-                sys.exit(1)
-            _, price_dimensions_value = price_dimensions.popitem()
-            price = float(price_dimensions_value["pricePerUnit"]["USD"])
-            self.emr_prices[instance_type] = price
+                self._emr_prices = emr_prices.result()
+                self._ec2_prices = ec2_prices.result()
 
-        ec2_regions_response = requests.get(
-            url_base + index["offers"]["AmazonEC2"]["currentRegionIndexUrl"]
-        )
-        ec2_region_url = (
-            url_base
-            + ec2_regions_response.json()["regions"][region]["currentVersionUrl"]
-        )
+    @property
+    def emr_prices(self):
+        if self._emr_prices is None:
+            self._load_prices()
+        return self._emr_prices
 
-        ec2_pricing = requests.get(ec2_region_url).json()
+    @emr_prices.setter
+    def emr_prices(self, prices):
+        self._emr_prices = prices
 
-        ec2_sku_to_instance_type = {}
-        for sku in ec2_pricing["products"]:
-            try:
-                attr = ec2_pricing["products"][sku]["attributes"]
-                if (
-                    attr["tenancy"] == "Shared"
-                    and attr["operatingSystem"] == "Linux"
-                    and attr["operation"] == "RunInstances"
-                    and attr["capacitystatus"] == "Used"
-                ):
-                    ec2_sku_to_instance_type[sku] = attr["instanceType"]
+    @property
+    def ec2_prices(self):
+        if self._ec2_prices is None:
+            self._load_prices()
+        return self._ec2_prices
 
-            except KeyError:
-                pass
+    @ec2_prices.setter
+    def ec2_prices(self, prices):
+        self._ec2_prices = prices
 
-        self.ec2_prices = {}
-        for sku in ec2_sku_to_instance_type.keys():
-            instance_type = ec2_sku_to_instance_type.get(sku)
-            sku_info = ec2_pricing["terms"]["OnDemand"][sku]
-            if len(sku_info) > 1:
-                print(
-                    "[ERROR] More than one SKU for {}".format(sku_info), file=sys.stderr
+    def _get_prices(self, offer_code, parse_offer):
+        """
+        Returns the price table of an offer, from the cache if it holds a
+        valid one or from the pricing API otherwise.
+        """
+        instrumentation = self.instrumentation
+        if self.cache is not None and self.offline:
+            prices = self.cache.load(self.region, offer_code)
+            if prices is not None:
+                instrumentation.count("cache_hits", cache="pricing", offer=offer_code)
+                return prices
+
+        validators = None
+        if self.cache is not None:
+            validators = self.cache.load_validators(self.region, offer_code)
+        version_url, new_validators = self._get_version_url(offer_code, validators)
+        if self.cache is not None:
+            prices = self.cache.load(self.region, offer_code, version_url)
+            if prices is not None:
+                instrumentation.count("cache_hits", cache="pricing", offer=offer_code)
+                # the version was just confirmed, so the entry is fresh again
+                # for offline runs and the max age
+                self.cache.store(
+                    self.region, offer_code, version_url, prices, new_validators
                 )
-                sys.exit(1)
-            _, sku_info_value = sku_info.popitem()
-            price_dimensions = sku_info_value["priceDimensions"]
-            if len(sku_info) > 1:
-                print(
-                    "[ERROR] More than price dimension for {}".format(price_dimensions),
-                    file=sys.stderr,
+                return prices
+            instrumentation.count("cache_misses", cache="pricing", offer=offer_code)
+
+        with instrumentation.timer("offer_load", offer=offer_code):
+            path = self._download(version_url, offer_code)
+            try:
+                prices = parse_offer(iter_file_chunks(path), workers=self.parse_workers)
+            finally:
+                os.remove(path)
+        if self.cache is not None:
+            self.cache.store(
+                self.region, offer_code, version_url, prices, new_validators
+            )
+        return prices
+
+    def _request(self, path, stream=False, headers=None):
+        self.instrumentation.count("http_requests", host="pricing")
+        return get_session().get(self.url_base + path, stream=stream, headers=headers)
+
+    def _download(self, path, offer_code):
+        """
+        Streams an offer file to a temporary file, so that the connection is
+        released as soon as the body is received and the file is never held
+        in memory
+        :return: The path of the temporary file, to be removed by the caller
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.download_dir, suffix=".json")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with self._request(path, stream=True) as response:
+                    response.raise_for_status()
+                    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                    if self.instrumentation.enabled:
+                        chunks = self._measure_download(response, chunks, offer_code)
+                    for chunk in chunks:
+                        f.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def _measure_download(self, response, chunks, offer_code):
+        """
+        Passes the chunks of an offer file through, timing the wait for each
+        of them and counting the bytes received for them
+        """
+        instrumentation = self.instrumentation
+        chunks = iter(chunks)
+        received = 0
+        while True:
+            with instrumentation.timer("offer_download", offer=offer_code):
+                chunk = next(chunks, None)
+            total_received = bytes_received(response)
+            if total_received > received:
+                instrumentation.count(
+                    "bytes_downloaded", total_received - received, source="pricing"
                 )
-                sys.exit(1)
-            _, price_dimensions_value = price_dimensions.popitem()
-            price = float(price_dimensions_value["pricePerUnit"]["USD"])
-            if instance_type in self.ec2_prices:
-                print(
-                    "[ERROR] Instance price for {} already added".format(instance_type),
-                    file=sys.stderr,
+                received = total_received
+            if chunk is None:
+                return
+            yield chunk
+
+    def _get_index(self):
+        with self._index_lock:
+            if self._index is None:
+                index_response = self._request(self.index_path)
+                index_response.raise_for_status()
+                self.instrumentation.count(
+                    "bytes_downloaded", bytes_received(index_response), source="pricing"
                 )
-                sys.exit(1)
+                self._index = index_response.json()
+            return self._index
+
+    def _get_version_url(self, offer_code, validators=None):
+        """
+        Finds the current version of the regional offer file. With the
+        validators of a previous answer, the regional index is only
+        downloaded again if it changed since then, and the offer index is not
+        needed at all.
+        :param validators: Optional dict with the region_index_url, etag,
+                last_modified and version_url of a previous answer
+        :return: The path of the current version and the validators of the
+                answer
+        """
+        instrumentation = self.instrumentation
+        headers = {}
+        if validators is not None:
+            region_index_url = validators["region_index_url"]
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        else:
+            region_index_url = self._get_index()["offers"][offer_code][
+                "currentRegionIndexUrl"
+            ]
+
+        regions_response = self._request(region_index_url, headers=headers)
+        if validators is not None and regions_response.status_code == 404:
+            # the regional index moved, look it up in the offer index again
+            return self._get_version_url(offer_code)
+        if regions_response.status_code == 304:
+            instrumentation.count("not_modified", host="pricing")
+            return validators["version_url"], validators
+        regions_response.raise_for_status()
+        instrumentation.count(
+            "bytes_downloaded", bytes_received(regions_response), source="pricing"
+        )
+        version_url = regions_response.json()["regions"][self.region][
+            "currentVersionUrl"
+        ]
+        return version_url, {
+            "region_index_url": region_index_url,
+            "etag": regions_response.headers.get("ETag"),
+            "last_modified": regions_response.headers.get("Last-Modified"),
+            "version_url": version_url,
+        }
+
+    @classmethod
+    def get_offer_index(cls):
+        """
+        :return: The global index of the offer files, listing the regional
+                index of every offer
+        """
+        response = get_session().get(cls.url_base + cls.index_path)
+        response.raise_for_status()
+        return response.json()
 
-            self.ec2_prices[instance_type] = price
+    @classmethod
+    def from_prices(cls, region, ec2_prices, emr_prices):
+        """
+        Builds the pricing from already reduced price tables, without any
+        request to the pricing API
+        """
+        pricing = cls.__new__(cls)
+        pricing.region = region
+        pricing.cache = None
+        pricing.offline = True
+        pricing.instrumentation = NULL_INSTRUMENTATION
+        pricing._index = None
+        pricing._index_lock = threading.Lock()
+        pricing.parse_workers = 1
+        pricing.download_dir = None
+        pricing._prices_lock = threading.Lock()
+        pricing.ec2_prices = dict(ec2_prices)
+        pricing.emr_prices = dict(emr_prices)
+        return pricing
+
+    @classmethod
+    def from_snapshot(cls, snapshot: PriceSnapshot):
+        """
+        Builds the pricing from the price tables of a snapshot, which are
+        read in place from the mapped file
+        """
+        pricing = cls.from_prices(snapshot.region, {}, {})
+        pricing.ec2_prices = snapshot.ec2_prices
+        pricing.emr_prices = snapshot.emr_prices
+        return pricing
 
     def get_emr_price(self, instance_type):
         return self.emr_prices[instance_type]
@@ -162,34 +447,175 @@ class Ec2EmrPricing:
 
 
 class EmrCostCalculator:
-    def __init__(self, region: str = None):
+    def __init__(
+        self,
+        region: str = None,
+        pricing_cache: typing.Optional[PricingCache] = None,
+        offline: bool = False,
+        endpoint_url: typing.Optional[str] = None,
+        emr_client=None,
+        spot_pricing=None,
+        ec2_emr_pricing=None,
+        instrumentation=None,
+        parse_workers: int = 1,
+        snapshot: typing.Optional[PriceSnapshot] = None,
+        rate_limiter: typing.Optional[RateLimiter] = None,
+        cost_cache_size: int = 1024,
+        running_cost_ttl: float = 300.0,
+        capture: typing.Optional[ResponseArchive] = None,
+        replay: typing.Optional[ResponseArchive] = None,
+    ):
+        """
+        :param endpoint_url: Optional endpoint of the EMR and EC2 APIs, e.g.
+                a local stub server
+        :param emr_client: Optional EMR client to use instead of creating one
+        :param spot_pricing: Optional SpotPricing to use instead of creating one
+        :param ec2_emr_pricing: Optional Ec2EmrPricing to use instead of
+                downloading the price lists
+        :param instrumentation: Optional Instrumentation recording timers and
+                counters of the API calls, also passed to the SpotPricing and
+                Ec2EmrPricing created here
+        :param parse_workers: Number of processes parsing the downloaded
+                price lists
+        :param snapshot: Optional PriceSnapshot providing the price tables
+                and spot price histories instead of the network. Spot prices
+                outside of the periods it covers are still fetched.
+        :param rate_limiter: Optional RateLimiter of the EMR and EC2 calls,
+                also used by the SpotPricing created here. By default the
+                calls are limited to DEFAULT_RATE_LIMITS, except in a replay.
+        :param cost_cache_size: Number of cluster costs memoized by
+                get_cluster_cost, 0 to disable it
+        :param running_cost_ttl: Seconds the cost of a cluster that is still
+                running is memoized for
+        :param capture: Optional ResponseArchive where every EMR and EC2
+                response is recorded, saved with save_archive
+        :param replay: Optional ResponseArchive answering every EMR and EC2
+                call and providing the price tables instead of the network
+        """
+        if replay is not None:
+            if region is not None and region != replay.region:
+                raise ValueError(
+                    "The archive is for region {}, not {}".format(replay.region, region)
+                )
+            region = replay.region
+            if emr_client is None:
+                emr_client = replay.client("emr")
+            if ec2_emr_pricing is None:
+                ec2_emr_pricing = Ec2EmrPricing.from_prices(
+                    region, replay.ec2_prices, replay.emr_prices
+                )
+        if region is None and snapshot is not None:
+            region = snapshot.region
         if region is None:
-            my_session = boto3.session.Session()
-            region = my_session.region_name
-        try:
-            self.conn = boto3.client("emr", region_name=region)
-        except Exception as e:
-            print(
-                "[ERROR] Could not establish connection with EMR API\n{}".format(e),
-                file=sys.stderr,
+            region = default_region()
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        if rate_limiter is None:
+            # a replay never reaches AWS, so it runs at CPU speed
+            rate_limiter = RateLimiter(
+                DEFAULT_RATE_LIMITS if replay is None else None,
+                instrumentation=self.instrumentation,
             )
-            sys.exit()
+        self.rate_limiter = rate_limiter
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.capture = capture
+        if capture is not None and emr_client is not None:
+            emr_client = capture.record(emr_client, "emr")
+        # the EMR client is created on the first call
+        self._conn = emr_client
+        self._conn_lock = threading.Lock()
 
-        try:
-            self.spot_pricing = SpotPricing(region=region)
-        except Exception as e:
-            print(
-                "[ERROR] Could not establish connection with EC2 API\n{}".format(e),
-                file=sys.stderr,
+        self.spot_pricing = spot_pricing
+        if self.spot_pricing is None:
+            try:
+                self.spot_pricing = SpotPricing(
+                    region=region,
+                    endpoint_url=endpoint_url,
+                    instrumentation=self.instrumentation,
+                    rate_limiter=self.rate_limiter,
+                )
+                if replay is not None:
+                    self.spot_pricing.client_ec2 = replay.client("ec2")
+            except Exception as e:
+                print(
+                    "[ERROR] Could not establish connection with EC2 API\n{}".format(e),
+                    file=sys.stderr,
+                )
+                sys.exit()
+        if capture is not None:
+            self.spot_pricing.record_to(capture)
+
+        self.ec2_emr_pricing = ec2_emr_pricing
+        if snapshot is not None:
+            if snapshot.region != region:
+                raise ValueError(
+                    "Snapshot {} is for region {}, not {}".format(
+                        snapshot.path, snapshot.region, region
+                    )
+                )
+            self.spot_pricing.load_snapshot(snapshot)
+            if self.ec2_emr_pricing is None:
+                self.ec2_emr_pricing = Ec2EmrPricing.from_snapshot(snapshot)
+        if self.ec2_emr_pricing is None:
+            self.ec2_emr_pricing = Ec2EmrPricing(
+                region=region,
+                cache=pricing_cache,
+                offline=offline,
+                instrumentation=self.instrumentation,
+                parse_workers=parse_workers,
             )
-            sys.exit()
 
-        self.ec2_emr_pricing = Ec2EmrPricing(region=region)
+        self.cost_cache = ClusterCostCache(cost_cache_size, running_cost_ttl)
+        # least recently used first, evicted together with their api_calls
+        self._cluster_info = collections.OrderedDict()
+        self._cluster_info_size = max(cost_cache_size, MIN_CLUSTER_INFO_SIZE)
+        self._cluster_info_lock = threading.Lock()
+        # EMR calls made per cluster, for debugging
+        self.api_calls = collections.OrderedDict()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self._conn_lock:
+                if self._conn is None:
+                    try:
+                        conn = create_client("emr", self.region, self.endpoint_url)
+                        if self.capture is not None:
+                            conn = self.capture.record(conn, "emr")
+                        self._conn = conn
+                    except Exception as e:
+                        print(
+                            "[ERROR] Could not establish connection with EMR API\n"
+                            "{}".format(e),
+                            file=sys.stderr,
+                        )
+                        sys.exit()
+        return self._conn
 
-    def get_total_cost_by_dates(self, created_after, created_before):
+    @conn.setter
+    def conn(self, client):
+        self._conn = client
+
+    def get_total_cost_by_dates(
+        self,
+        created_after,
+        created_before,
+        workers=1,
+        ledger: typing.Optional[CostLedger] = None,
+        prefetch_spot=False,
+    ):
+        """
+        :param workers: Number of clusters whose cost is computed concurrently
+        :param ledger: Optional CostLedger. Clusters whose final cost is in
+                it are not queried again and new costs are added to it.
+        :param prefetch_spot: Collect the instances of all the clusters before
+                pricing them, so that every spot price history is fetched
+                only once
+        """
         total_cost = 0
-        for cluster_id in self._get_cluster_list(created_after, created_before):
-            cost_dict = self.get_cluster_cost(cluster_id)
+        for cluster_id, cost_dict in self._iter_period_costs(
+            created_after, created_before, workers, ledger, prefetch_spot
+        ):
             if "TOTAL" in cost_dict:
                 total_cost += cost_dict["TOTAL"]
             else:
@@ -201,11 +627,255 @@ class EmrCostCalculator:
                 )
         return total_cost
 
-    @retry(
-        wait_exponential_multiplier=1000,
-        wait_exponential_max=7000,
-        retry_on_exception=is_error_retriable,
-    )
+    def iter_cluster_costs(
+        self,
+        created_after,
+        created_before,
+        workers=1,
+        ledger: typing.Optional[CostLedger] = None,
+        prefetch_spot=False,
+        skip_cluster_ids: typing.Container[str] = (),
+    ):
+        """
+        Yields the cost of every cluster created in the period as soon as it
+        is known, instead of only the total at the end. What is remembered
+        about a cluster is dropped once it has been yielded, so memory does
+        not grow with the number of clusters (except with prefetch_spot,
+        which collects all the instances first).
+        :param skip_cluster_ids: Clusters not to compute, e.g. the ones
+                already reported by an interrupted run
+        :return: An iterator of (cluster_id, cost_dict) tuples, in the order
+                the clusters are listed
+        """
+        previous_id = None
+        for cluster_id, cost_dict in self._iter_period_costs(
+            created_after,
+            created_before,
+            workers,
+            ledger,
+            prefetch_spot,
+            skip_cluster_ids,
+        ):
+            if previous_id is not None:
+                self._forget_cluster(previous_id)
+            yield cluster_id, cost_dict
+            previous_id = cluster_id
+        if previous_id is not None:
+            self._forget_cluster(previous_id)
+
+    def _iter_period_costs(
+        self,
+        created_after,
+        created_before,
+        workers=1,
+        ledger=None,
+        prefetch_spot=False,
+        skip_cluster_ids=(),
+    ):
+        """
+        :return: An iterator of (cluster_id, cost_dict) tuples for the
+                clusters created in the period
+        """
+        if ledger is None:
+            cluster_ids = self._skip_clusters(
+                self._get_cluster_list(created_after, created_before),
+                skip_cluster_ids,
+            )
+            for cluster_id, cost_dict in self._iter_cluster_costs(
+                cluster_ids, workers, prefetch_spot=prefetch_spot
+            ):
+                yield cluster_id, cost_dict
+            return
+
+        period_costs = ledger.get_period_costs(
+            self.region, created_after, created_before
+        )
+        if period_costs is not None:
+            for cluster_id, cost_dict in period_costs:
+                if cluster_id not in skip_cluster_ids:
+                    yield cluster_id, cost_dict
+            return
+
+        summaries = {}
+        final_ids = set()
+
+        def get_final_cost(cluster_id):
+            cost_dict = ledger.get_final_cost(self.region, cluster_id)
+            if cost_dict is not None:
+                final_ids.add(cluster_id)
+            return cost_dict
+
+        skipped = []
+
+        def list_cluster_ids():
+            for summary in self._get_cluster_summaries(created_after, created_before):
+                if summary["Id"] in skip_cluster_ids:
+                    skipped.append(summary["Id"])
+                    self._forget_cluster(summary["Id"])
+                    continue
+                summaries[summary["Id"]] = summary
+                yield summary["Id"]
+
+        for cluster_id, cost_dict in self._iter_cluster_costs(
+            list_cluster_ids(), workers, get_final_cost, prefetch_spot
+        ):
+            status = summaries.pop(cluster_id)["Status"]
+            if cluster_id not in final_ids:
+                ledger.store(
+                    self.region,
+                    cluster_id,
+                    status["Timeline"].get("CreationDateTime"),
+                    status["State"],
+                    cost_dict,
+                )
+            yield cluster_id, cost_dict
+        # skipped clusters may be missing from the ledger, so the period can
+        # only be known as complete if none was skipped
+        if not skipped:
+            ledger.record_listing(self.region, created_after, created_before)
+
+    def _skip_clusters(self, cluster_ids, skip_cluster_ids):
+        for cluster_id in cluster_ids:
+            if cluster_id in skip_cluster_ids:
+                self._forget_cluster(cluster_id)
+            else:
+                yield cluster_id
+
+    def _iter_cluster_costs(
+        self, cluster_ids, workers=1, get_cached_cost=None, prefetch_spot=False
+    ):
+        """
+        Computes the cost of each cluster, using a pool of worker threads if
+        more than one worker is requested. At most two clusters per worker
+        are in flight at any time and the results come out in the order of
+        cluster_ids.
+        :param get_cached_cost: Optional function returning the already known
+                cost_dict of a cluster, or None if it has to be computed
+        :param prefetch_spot: See _iter_planned_cluster_costs
+        :return: An iterator of (cluster_id, cost_dict) tuples
+        """
+        if prefetch_spot:
+            for cluster_id, cost_dict in self._iter_planned_cluster_costs(
+                cluster_ids, workers, get_cached_cost
+            ):
+                yield cluster_id, cost_dict
+            return
+
+        for cluster_id, cost_dict in self._map_clusters(
+            self.get_cluster_cost, cluster_ids, workers, get_cached_cost
+        ):
+            yield cluster_id, cost_dict
+
+    @staticmethod
+    def _map_clusters(function, cluster_ids, workers=1, get_cached_result=None):
+        """
+        Calls function on each cluster id, using a pool of worker threads if
+        more than one worker is requested. At most two clusters per worker
+        are in flight at any time and the results come out in the order of
+        cluster_ids.
+        :param get_cached_result: Optional function returning the already
+                known result for a cluster, or None if it has to be computed
+        :return: An iterator of (cluster_id, result) tuples
+        """
+        if workers <= 1:
+            for cluster_id in cluster_ids:
+                result = None
+                if get_cached_result is not None:
+                    result = get_cached_result(cluster_id)
+                if result is None:
+                    result = function(cluster_id)
+                yield cluster_id, result
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = collections.deque()
+            for cluster_id in cluster_ids:
+                if len(in_flight) >= 2 * workers:
+                    done_id, future = in_flight.popleft()
+                    yield done_id, future.result()
+                result = None
+                if get_cached_result is not None:
+                    result = get_cached_result(cluster_id)
+                if result is None:
+                    future = executor.submit(function, cluster_id)
+                else:
+                    future = concurrent.futures.Future()
+                    future.set_result(result)
+                in_flight.append((cluster_id, future))
+            while in_flight:
+                done_id, future = in_flight.popleft()
+                yield done_id, future.result()
+
+    def _iter_planned_cluster_costs(self, cluster_ids, workers=1, get_cached_cost=None):
+        """
+        Collects the instances of all the clusters first. Then the spot price
+        history of every (instance type, AZ) they use is fetched exactly once,
+        in parallel, for the period covering all its instances, and only then
+        are the clusters priced. This trades memory (all instances are held
+        as InstanceBatch columns) for the minimum of spot price requests.
+        :return: An iterator of (cluster_id, cost_dict) tuples
+        """
+        cluster_ids = list(cluster_ids)
+        cached_costs = {}
+        if get_cached_cost is not None:
+            for cluster_id in cluster_ids:
+                cost_dict = get_cached_cost(cluster_id)
+                if cost_dict is not None:
+                    cached_costs[cluster_id] = cost_dict
+        to_collect = [c for c in cluster_ids if c not in cached_costs]
+
+        if workers <= 1:
+            batches = [self._collect_cluster_batch(c) for c in to_collect]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                batches = list(executor.map(self._collect_cluster_batch, to_collect))
+        batches = dict(zip(to_collect, batches))
+
+        periods = {}
+        for batch in batches.values():
+            spot_periods(batch, periods)
+        self.spot_pricing.prefetch_periods(periods, workers)
+
+        for cluster_id in cluster_ids:
+            if cluster_id in cached_costs:
+                yield cluster_id, cached_costs.pop(cluster_id)
+            else:
+                yield cluster_id, self.get_batch_cost(batches.pop(cluster_id))
+
+    def _collect_cluster_batch(self, cluster_id, start_date=None, end_date=None):
+        return self.get_cluster_instance_batch(cluster_id, start_date, end_date)
+
+    def get_cost_rollup(
+        self,
+        created_after,
+        created_before,
+        bucket_seconds=BUCKET_SECONDS["hour"],
+        workers=1,
+    ) -> CostRollup:
+        """
+        Splits the costs of the clusters created in the period into time
+        buckets. The instances of every cluster are listed once and added to
+        the rollup, then dropped, so memory does not grow with the number of
+        clusters. Only the costs incurred inside the period are counted.
+        :param bucket_seconds: Size of the buckets, e.g. BUCKET_SECONDS["day"]
+        :param workers: Number of clusters whose instances are listed
+                concurrently
+        :return: A CostRollup of the period
+        """
+        rollup = CostRollup(created_after, created_before, bucket_seconds)
+        collect = functools.partial(
+            self._collect_cluster_batch,
+            start_date=created_after,
+            end_date=created_before,
+        )
+        with self.instrumentation.timer("cost_rollup"):
+            for cluster_id, batch in self._map_clusters(
+                collect, self._get_cluster_list(created_after, created_before), workers
+            ):
+                rollup.add_batch(batch, self.ec2_emr_pricing, self.spot_pricing)
+                self._forget_cluster(cluster_id)
+        return rollup
+
     def get_cluster_cost(
         self,
         cluster_id: str,
@@ -216,78 +886,134 @@ class EmrCostCalculator:
         Joins the information from the instance groups and the instances
         in order to calculate the price of the whole cluster
 
-        It is important that we use a back off policy in this case since Amazon
-        throttles the number of API requests.
+        Amazon throttles the number of API requests, so every call goes
+        through the rate limiter, which retries a throttled call (or page)
+        on its own without starting the cluster over.
+
+        The costs are memoized in cost_cache: the cost of a terminated cluster
+        is reused as long as it is not evicted, the one of a running cluster
+        only for a short time.
         :return: A dictionary with the total cost of the cluster and the
                 individual cost of each instance group (Master, Core, Task)
         """
-        cost_dict: typing.Dict[str, float] = {}
-        availability_zone = self._get_availability_zone(cluster_id)
+        key = (cluster_id, start_date, end_date)
+        cost_dict = self.cost_cache.get(key)
+        if cost_dict is not None:
+            self.instrumentation.count("cache_hits", cache="cluster_cost")
+            return cost_dict
+        self.instrumentation.count("cache_misses", cache="cluster_cost")
+        # a cluster that was running may have terminated since
+        self._forget_running_cluster(cluster_id)
 
-        try:
-            instance_groups = self._get_instance_groups(cluster_id)
-
-            for instance_group in instance_groups:
-                for instance in self._get_instances(
-                    instance_group, cluster_id, start_date, end_date
-                ):
-                    cost = self._get_instance_cost(instance, availability_zone)
-                    group_type = instance_group.group_type
-                    cost_dict.setdefault(group_type + ".EC2", 0)
-                    cost_dict[group_type + ".EC2"] += cost
-                    cost_dict.setdefault(group_type + ".EMR", 0)
-                    hours_run = (
-                        instance.termination_ts - instance.creation_ts
-                    ).total_seconds() / 3600
-                    emr_cost = (
-                        self.ec2_emr_pricing.get_emr_price(instance.instance_type)
-                        * hours_run
-                    )
-                    cost_dict[group_type + ".EMR"] += emr_cost
-                    # ebs
-                    ebs_cost = 0
-                    cost_dict.setdefault(group_type + ".EBS", 0)
-                    for ebs in instance_group.disk_size:
-                        ebs_cost = ebs_cost + ebs["VolumeSpecification"][
-                            "SizeInGB"
-                        ] * 0.1 * hours_run / (24 * 30)
-                    cost_dict[group_type + ".EBS"] += ebs_cost
-                    cost_dict.setdefault("TOTAL", 0)
-                    cost_dict["TOTAL"] += cost + emr_cost + ebs_cost
-        except Exception:
-            instance_fleets = self._get_instance_fleets(cluster_id)
-            for instance_fleet in instance_fleets:
-                for instance in self._get_instances(
-                    instance_fleet, cluster_id, start_date, end_date, True
-                ):
-                    cost = self._get_instance_cost(instance, availability_zone)
-                    if cost is None:
-                        cost = 0
-                    group_type = instance_fleet.group_type
-                    cost_dict.setdefault(group_type + ".EC2", 0)
-                    cost_dict[group_type + ".EC2"] += cost
-                    cost_dict.setdefault(group_type + ".EMR", 0)
-                    hours_run = (
-                        instance.termination_ts - instance.creation_ts
-                    ).total_seconds() / 3600
-                    emr_cost = (
-                        self.ec2_emr_pricing.get_emr_price(instance.instance_type)
-                        * hours_run
-                    )
-                    cost_dict[group_type + ".EMR"] += emr_cost
-                    # ebs
-                    ebs_cost = 0
-                    cost_dict.setdefault(group_type + ".EBS", 0)
-                    for ebs in instance_fleet.disk_size:
-                        ebs_cost = ebs_cost + ebs["VolumeSpecification"][
-                            "SizeInGB"
-                        ] * 0.1 * hours_run / (24 * 30)
-                    cost_dict[group_type + ".EBS"] += ebs_cost
-                    cost_dict.setdefault("TOTAL", 0)
-                    cost_dict["TOTAL"] += cost + emr_cost + ebs_cost
+        cost_dict = {}
+        with self.instrumentation.timer("cluster_cost"):
+            cluster_info = self._get_cluster_info(cluster_id)
+            if not cluster_info.never_ran:
+                availability_zone = cluster_info.availability_zone
+                instance_groups, fleet = self._get_instance_groups_or_fleets(cluster_id)
+                for instance_group in instance_groups:
+                    if fleet:
+                        instances = self._get_instances(
+                            instance_group, cluster_id, start_date, end_date, fleet
+                        )
+                        self._add_fleet_cost(
+                            cost_dict, instance_group, instances, availability_zone
+                        )
+                        continue
+                    for instance in self._get_instances(
+                        instance_group, cluster_id, start_date, end_date, fleet
+                    ):
+                        self._add_instance_cost(
+                            cost_dict, instance_group, instance, availability_zone
+                        )
 
+        self.cost_cache.put(key, cost_dict, cluster_info.state)
         return cost_dict
 
+    def get_cluster_instance_batch(
+        self,
+        cluster_id: str,
+        start_date: typing.Optional[datetime.datetime] = None,
+        end_date: typing.Optional[datetime.datetime] = None,
+        batch: typing.Optional[InstanceBatch] = None,
+    ) -> InstanceBatch:
+        """
+        Collects the instances of a cluster as columns of an InstanceBatch.
+        Passing the same batch for several clusters collects the instances
+        of a whole date range, to be priced at once with get_batch_cost.
+        """
+        if batch is None:
+            batch = InstanceBatch()
+        cluster_info = self._get_cluster_info(cluster_id)
+        if cluster_info.never_ran:
+            return batch
+        availability_zone = cluster_info.availability_zone
+        instance_groups, fleet = self._get_instance_groups_or_fleets(cluster_id)
+        for instance_group in instance_groups:
+            for instance in self._get_instances(
+                instance_group, cluster_id, start_date, end_date, fleet
+            ):
+                batch.append_instance(instance, instance_group, availability_zone)
+        return batch
+
+    def get_batch_cost(self, batch: InstanceBatch) -> typing.Dict[str, float]:
+        """
+        Prices all the instances of a batch in one pass
+        :return: A dictionary like the one of get_cluster_cost
+        """
+        with self.instrumentation.timer("batch_cost"):
+            return compute_batch_cost(batch, self.ec2_emr_pricing, self.spot_pricing)
+
+    def _add_fleet_cost(
+        self, cost_dict, fleet: InstanceFleet, instances, availability_zone
+    ):
+        """
+        Adds the costs of the instances of a fleet, whatever the mix of
+        instance types, to cost_dict. The instances are collected as the
+        columns of an InstanceBatch, with the EBS size of their own type, so
+        the prices and the spot price series of every type are looked up
+        once and all the instances are priced in a single pass.
+        :param instances: The Ec2Instances of the fleet
+        """
+        batch = InstanceBatch()
+        for instance in instances:
+            batch.append_instance(instance, fleet, availability_zone)
+        fleet_cost = compute_batch_cost(batch, self.ec2_emr_pricing, self.spot_pricing)
+        for key, cost in fleet_cost.items():
+            cost_dict[key] = cost_dict.get(key, 0) + cost
+
+    def _add_instance_cost(
+        self, cost_dict, instance_group, instance, availability_zone
+    ):
+        """
+        Adds the EC2, EMR and EBS cost of an instance to the entries of its
+        group type (and to the TOTAL) in cost_dict
+        """
+        cost = self._get_instance_cost(instance, availability_zone)
+        if cost is None:
+            cost = 0
+        group_type = instance_group.group_type
+        cost_dict.setdefault(group_type + ".EC2", 0)
+        cost_dict[group_type + ".EC2"] += cost
+        cost_dict.setdefault(group_type + ".EMR", 0)
+        hours_run = (
+            instance.termination_ts - instance.creation_ts
+        ).total_seconds() / 3600
+        emr_cost = (
+            self.ec2_emr_pricing.get_emr_price(instance.instance_type) * hours_run
+        )
+        cost_dict[group_type + ".EMR"] += emr_cost
+        # ebs
+        ebs_cost = 0
+        cost_dict.setdefault(group_type + ".EBS", 0)
+        for ebs in instance_group.disk_size:
+            ebs_cost = ebs_cost + ebs["VolumeSpecification"][
+                "SizeInGB"
+            ] * 0.1 * hours_run / (24 * 30)
+        cost_dict[group_type + ".EBS"] += ebs_cost
+        cost_dict.setdefault("TOTAL", 0)
+        cost_dict["TOTAL"] += cost + emr_cost + ebs_cost
+
     def _get_instance_cost(self, instance, availability_zone):
         if instance.market_type == "SPOT":
             return self.spot_pricing.get_billed_price_for_period(
@@ -307,22 +1033,47 @@ class EmrCostCalculator:
         """
         :return: An iterator of cluster ids for the specified dates
         """
+        for cluster in self._get_cluster_summaries(created_after, created_before):
+            yield cluster["Id"]
+
+    def _get_cluster_summaries(self, created_after, created_before):
+        """
+        :return: An iterator of the list_clusters summaries (id, status,
+                normalized instance hours) for the specified dates
+        """
         kwargs = {"CreatedAfter": created_after, "CreatedBefore": created_before}
         while True:
-            cluster_list = self.conn.list_clusters(**kwargs)
+            cluster_list = self.rate_limiter.call(
+                "list_clusters", self._list_clusters_page, kwargs
+            )
+            self.instrumentation.count("pages", operation="list_clusters")
             for cluster in cluster_list["Clusters"]:
-                yield cluster["Id"]
+                self._remember_cluster_summary(cluster)
+                yield cluster
             try:
                 kwargs["Marker"] = cluster_list["Marker"]
             except KeyError:
                 break
 
+    def _list_clusters_page(self, kwargs):
+        with self.instrumentation.timer("aws_call", operation="list_clusters"):
+            return self.conn.list_clusters(**kwargs)
+
+    def _get_instance_groups_or_fleets(self, cluster_id):
+        """
+        :return: The instance groups of the cluster, or its instance fleets
+                if it uses fleets, and whether they are fleets
+        """
+        if self._get_cluster_info(cluster_id).is_fleet:
+            return self._get_instance_fleets(cluster_id), True
+        return self._get_instance_groups(cluster_id), False
+
     def _get_instance_groups(self, cluster_id):
         """
         Invokes the EMR api and gets a list of the cluster's instance groups.
         :return: List of our custom InstanceGroup objects
         """
-        groups = self.conn.list_instance_groups(ClusterId=cluster_id)["InstanceGroups"]
+        groups = self._call_emr(cluster_id, "list_instance_groups")["InstanceGroups"]
         instance_groups = []
         for group in groups:
             inst_group = InstanceGroup(
@@ -340,18 +1091,15 @@ class EmrCostCalculator:
         Invokes the EMR api and gets a list of the cluster's instance fleets.
         :return: List of our custom InstanceFleet objects
         """
-        fleets = self.conn.list_instance_fleets(ClusterId=cluster_id)["InstanceFleets"]
-        instance_fleets = []
-        for fleet in fleets:
-            inst_fleet = InstanceGroup(
+        fleets = self._call_emr(cluster_id, "list_instance_fleets")["InstanceFleets"]
+        return [
+            InstanceFleet(
                 fleet["Id"],
-                fleet["InstanceTypeSpecifications"][0]["InstanceType"],
                 fleet["InstanceFleetType"],
-                self._get_ebs_block_devices(fleet["InstanceTypeSpecifications"][0]),
+                fleet.get("InstanceTypeSpecifications", ()),
             )
-
-            instance_fleets.append(inst_fleet)
-        return instance_fleets
+            for fleet in fleets
+        ]
 
     def _get_instances(
         self,
@@ -365,26 +1113,39 @@ class EmrCostCalculator:
         Invokes the EMR api to retrieve a list of all the instances
         that were used in the cluster.
         This list is then joined to the InstanceGroup list
-        on the instance group id
+        on the instance group id.
+        Every page of list_instances is turned into Ec2Instance objects and
+        dropped before the next one is requested, so memory does not grow
+        with the number of raw instance records.
         :return: An iterator of our custom Ec2Instance objects.
         """
-        instance_list = []
-        list_instances_args = {
-            "ClusterId": cluster_id,
-            "InstanceGroupId": instance_group.group_id,
-        }
+        list_instances_args = {"InstanceGroupId": instance_group.group_id}
         if fleet:
-            list_instances_args = {
-                "ClusterId": cluster_id,
-                "InstanceFleetId": instance_group.group_id,
-            }
+            list_instances_args = {"InstanceFleetId": instance_group.group_id}
         while True:
-            batch = self.conn.list_instances(**list_instances_args)
-            instance_list.extend(batch["Instances"])
+            batch = self._call_emr(cluster_id, "list_instances", **list_instances_args)
+            self.instrumentation.count("pages", operation="list_instances")
+            for instance in self._parse_instances(
+                batch["Instances"], cluster_id, start_date, end_date
+            ):
+                yield instance
             try:
                 list_instances_args["Marker"] = batch["Marker"]
             except KeyError:
                 break
+
+    def _parse_instances(
+        self,
+        instance_list,
+        cluster_id,
+        start_date: typing.Optional[datetime.datetime],
+        end_date: typing.Optional[datetime.datetime],
+    ):
+        """
+        Turns list_instances records into Ec2Instance objects, clipping their
+        lifetime to [start_date, end_date] when both are given.
+        :return: An iterator of our custom Ec2Instance objects.
+        """
         for instance_info in instance_list:
             try:
                 creation_time: datetime.datetime = instance_info["Status"]["Timeline"][
@@ -413,12 +1174,16 @@ class EmrCostCalculator:
                     if end_date_time >= end_date_tz:
                         end_date_time = end_date_tz
 
+                # only the volume ids are kept, not the raw volume records
                 inst = Ec2Instance(
                     creation_time,
                     end_date_time,
                     instance_info["InstanceType"],
                     instance_info["Market"],
-                    instance_info["EbsVolumes"],
+                    tuple(
+                        volume["VolumeId"]
+                        for volume in instance_info.get("EbsVolumes", ())
+                    ),
                 )
                 yield inst
             except AttributeError as e:
@@ -435,48 +1200,273 @@ class EmrCostCalculator:
             ebsBlockDevices = spec_map["EbsBlockDevices"]
         return ebsBlockDevices
 
-    def _get_availability_zone(self, cluster_id):
-        cluster_description = self.conn.describe_cluster(ClusterId=cluster_id)
-        return cluster_description["Cluster"]["Ec2InstanceAttributes"][
-            "Ec2AvailabilityZone"
-        ]
+    def _get_cluster_info(self, cluster_id) -> ClusterInfo:
+        """
+        Resolves everything needed about a cluster with a single
+        describe_cluster call, remembered for later calls
+        """
+        with self._cluster_info_lock:
+            cluster_info = self._cluster_info.get(cluster_id)
+            if cluster_info is not None:
+                self._cluster_info.move_to_end(cluster_id)
+        if cluster_info is not None and cluster_info.availability_zone is not None:
+            return cluster_info
+        if cluster_info is not None and cluster_info.never_ran:
+            return cluster_info
+
+        cluster = self._call_emr(cluster_id, "describe_cluster")["Cluster"]
+        cluster_info = ClusterInfo(
+            cluster_id,
+            cluster["Ec2InstanceAttributes"]["Ec2AvailabilityZone"],
+            cluster.get("InstanceCollectionType", "INSTANCE_GROUP"),
+            cluster["Status"]["State"],
+            cluster.get("NormalizedInstanceHours"),
+        )
+        with self._cluster_info_lock:
+            self._cluster_info[cluster_id] = cluster_info
+            self._cluster_info.move_to_end(cluster_id)
+            self._evict_cluster_info()
+        return cluster_info
+
+    def _remember_cluster_summary(self, summary):
+        """
+        Keeps what list_clusters tells about a cluster, which is enough to
+        skip clusters that never ran without describing them
+        """
+        with self._cluster_info_lock:
+            if summary["Id"] not in self._cluster_info:
+                self._cluster_info[summary["Id"]] = ClusterInfo(
+                    summary["Id"],
+                    state=summary["Status"]["State"],
+                    normalized_instance_hours=summary.get("NormalizedInstanceHours"),
+                )
+                self._evict_cluster_info()
+
+    def _evict_cluster_info(self):
+        """
+        Drops what is remembered about the least recently used clusters
+        beyond the size limit. Must be called holding _cluster_info_lock.
+        """
+        while len(self._cluster_info) > self._cluster_info_size:
+            cluster_id, _ = self._cluster_info.popitem(last=False)
+            self.api_calls.pop(cluster_id, None)
+        while len(self.api_calls) > self._cluster_info_size:
+            self.api_calls.popitem(last=False)
+
+    def _forget_running_cluster(self, cluster_id):
+        """
+        Drops the describe_cluster result of a cluster that was not
+        terminated yet, so that its current state is read again
+        """
+        with self._cluster_info_lock:
+            cluster_info = self._cluster_info.get(cluster_id)
+            if (
+                cluster_info is not None
+                and cluster_info.availability_zone is not None
+                and cluster_info.state not in TERMINAL_STATES
+            ):
+                del self._cluster_info[cluster_id]
+
+    def _forget_cluster(self, cluster_id):
+        """
+        Drops what is remembered about a cluster that will not be priced
+        again
+        """
+        with self._cluster_info_lock:
+            self._cluster_info.pop(cluster_id, None)
+            self.api_calls.pop(cluster_id, None)
+
+    def _call_emr(self, cluster_id, operation, **kwargs):
+        """
+        Calls an EMR operation about a cluster, counting the calls made for
+        every cluster
+        """
+        with self._cluster_info_lock:
+            self.api_calls.setdefault(cluster_id, collections.Counter())[operation] += 1
+            self.api_calls.move_to_end(cluster_id)
+            self._evict_cluster_info()
+
+        def call():
+            with self.instrumentation.timer("aws_call", operation=operation):
+                return getattr(self.conn, operation)(ClusterId=cluster_id, **kwargs)
+
+        return self.rate_limiter.call(operation, call)
+
+    def save_snapshot(self, path: str):
+        """
+        Writes the price tables and every spot price history fetched so far
+        to a PriceSnapshot file
+        """
+        write_snapshot(
+            path,
+            self.ec2_emr_pricing.region,
+            self.ec2_emr_pricing.ec2_prices,
+            self.ec2_emr_pricing.emr_prices,
+            self.spot_pricing.price_series(),
+        )
+
+    def save_archive(self, path: str):
+        """
+        Writes the responses captured so far and the price tables looked up
+        to a ResponseArchive file
+        """
+        self.capture.region = self.region
+        pricing = self.ec2_emr_pricing
+        # the price tables are only there if a price was looked up
+        if pricing._ec2_prices is not None and pricing._emr_prices is not None:
+            self.capture.set_prices(pricing.ec2_prices, pricing.emr_prices)
+        self.capture.save(path)
+
+    def api_call_summary(self):
+        """
+        :return: A dict of {operation: number of calls} per cluster id
+        """
+        with self._cluster_info_lock:
+            return {
+                cluster_id: dict(calls) for cluster_id, calls in self.api_calls.items()
+            }
+
+
+# a price history fetched until less than this many seconds ago is not
+# fetched again for a period ending after it, so instances of running
+# clusters (which end "now") do not each trigger a request. A history that
+# ends earlier than that always has its missing tail fetched.
+COVERAGE_SLACK = 3600
 
 
 class SpotPricing:
-    def __init__(self, region: str = None):
+    def __init__(
+        self,
+        region: str = None,
+        endpoint_url: typing.Optional[str] = None,
+        instrumentation=None,
+        rate_limiter: typing.Optional[RateLimiter] = None,
+    ):
+        """
+        :param instrumentation: Optional Instrumentation recording the price
+                history requests and how often the fetched series are reused
+        :param rate_limiter: Optional RateLimiter of the price history
+                requests, limited to DEFAULT_RATE_LIMITS by default
+        """
         if region is None:
-            my_session = boto3.session.Session()
-            region = my_session.region_name
+            region = default_region()
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self.rate_limiter = rate_limiter or RateLimiter(
+            DEFAULT_RATE_LIMITS, instrumentation=self.instrumentation
+        )
         self.all_prices = {}
-        self.client_ec2 = boto3.client("ec2", region_name=region)
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.capture = None
+        # the EC2 client is only created when a spot price is first needed
+        self._client_ec2 = None
+        self._client_lock = threading.Lock()
+        # one lock per (instance type, availability zone) so that concurrent
+        # clusters never fetch the same price history twice
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # what fetching the price histories has cost so far
+        self.series_fetched = 0
+        self.requests_made = 0
+        self.bytes_fetched = 0
+
+    @property
+    def client_ec2(self):
+        if self._client_ec2 is None:
+            with self._client_lock:
+                if self._client_ec2 is None:
+                    self.client_ec2 = create_client(
+                        "ec2", self.region, self.endpoint_url
+                    )
+        return self._client_ec2
+
+    @client_ec2.setter
+    def client_ec2(self, client):
+        if self.capture is not None:
+            client = self.capture.record(client, "ec2")
+        self._client_ec2 = client
+
+    def record_to(self, archive: ResponseArchive):
+        """
+        Records every price history response into an archive from now on
+        """
+        with self._client_lock:
+            self.capture = archive
+            if self._client_ec2 is not None:
+                self._client_ec2 = archive.record(self._client_ec2, "ec2")
+
+    def _get_lock(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
 
     def _populate_all_prices_if_needed(
         self, instance_id, availability_zone, start_time, end_time
     ):
-        previous_ts = None
+        """
+        Fetches the price changes of [start_time, end_time] that are not in
+        the price series of the instance type yet. Only the missing parts of
+        the period are requested when a wider one is needed.
+        """
+        key = (instance_id, availability_zone)
+        with self._locks_lock:
+            series = self.all_prices.get(key)
+            if series is None:
+                series = SpotPriceSeries()
+                self.all_prices[key] = series
 
-        if (instance_id, availability_zone) in self.all_prices:
-            prices = self.all_prices[(instance_id, availability_zone)]
-            if (
-                end_time - sorted(prices.keys())[-1]
-                < datetime.timedelta(days=1, hours=1)
-                and sorted(prices.keys())[0] < start_time
-            ):
-                # this means we already have requested dates. Nothing to do
-                return
-        else:
-            prices = {}
+        start, end = start_time.timestamp(), end_time.timestamp()
+        slack = 0.0
+        if (
+            series.covered_end is not None
+            and series.covered_end >= time.time() - COVERAGE_SLACK
+        ):
+            slack = COVERAGE_SLACK
+        if series.covers(start, end, slack):
+            # this means we already have requested dates. Nothing to do
+            self.instrumentation.count("cache_hits", cache="spot_prices")
+            return
+        self.instrumentation.count("cache_misses", cache="spot_prices")
 
+        for missing_start, missing_end in series.missing_periods(start, end):
+            points = self._fetch_price_history(
+                instance_id,
+                availability_zone,
+                datetime.datetime.fromtimestamp(missing_start, tz=tz.tzutc()),
+                datetime.datetime.fromtimestamp(missing_end, tz=tz.tzutc()),
+            )
+            series.extend(points, missing_start, missing_end)
+
+    def _fetch_price_history(
+        self, instance_id, availability_zone, start_time, end_time
+    ):
+        """
+        :return: A dict of the spot prices per epoch timestamp. It includes
+                the price in effect at start_time.
+        """
+        previous_ts = None
+        prices = {}
         next_token = ""
+        with self._locks_lock:
+            self.series_fetched += 1
+        instrumentation = self.instrumentation
         while True:
-            prices_response = self.client_ec2.describe_spot_price_history(
-                InstanceTypes=[instance_id],
-                ProductDescriptions=["Linux/UNIX (Amazon VPC)"],
-                AvailabilityZone=availability_zone,
-                StartTime=start_time,
-                EndTime=end_time,
-                NextToken=next_token,
+            # a throttled page is retried with the same NextToken
+            prices_response = self.rate_limiter.call(
+                "describe_spot_price_history",
+                self._describe_spot_price_history_page,
+                instance_id,
+                availability_zone,
+                start_time,
+                end_time,
+                next_token,
             )
+            headers = prices_response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            content_length = int(headers.get("content-length", 0))
+            with self._locks_lock:
+                self.requests_made += 1
+                self.bytes_fetched += content_length
+            instrumentation.count("pages", operation="describe_spot_price_history")
+            instrumentation.count("bytes_downloaded", content_length, source="ec2")
             for price in prices_response["SpotPriceHistory"]:
                 if previous_ts is None:
                     previous_ts = price["Timestamp"]
@@ -494,50 +1484,107 @@ class SpotPricing:
                         file=sys.stderr,
                     )
                     quit(-1)
-                prices[price["Timestamp"]] = float(price["SpotPrice"])
+                prices[price["Timestamp"].timestamp()] = float(price["SpotPrice"])
                 previous_ts = price["Timestamp"]
 
             next_token = prices_response["NextToken"]
             if next_token == "":
                 break
+        return prices
 
-        self.all_prices[(instance_id, availability_zone)] = prices
-
-    def get_billed_price_for_period(
-        self, instance_id, availability_zone, start_time, end_time
+    def _describe_spot_price_history_page(
+        self, instance_id, availability_zone, start_time, end_time, next_token
     ):
-        self._populate_all_prices_if_needed(
-            instance_id, availability_zone, start_time, end_time
-        )
+        with self.instrumentation.timer(
+            "aws_call", operation="describe_spot_price_history"
+        ):
+            return self.client_ec2.describe_spot_price_history(
+                InstanceTypes=[instance_id],
+                ProductDescriptions=["Linux/UNIX (Amazon VPC)"],
+                AvailabilityZone=availability_zone,
+                StartTime=start_time,
+                EndTime=end_time,
+                NextToken=next_token,
+            )
 
-        prices = self.all_prices[(instance_id, availability_zone)]
+    def prefetch(self, instance_id, availability_zone, start_time, end_time):
+        """
+        Makes sure the price history of an instance type covers the given
+        period, so later billing queries inside it need no API call
+        """
+        with self._get_lock((instance_id, availability_zone)):
+            self._populate_all_prices_if_needed(
+                instance_id, availability_zone, start_time, end_time
+            )
 
-        summed_price = 0.0
-        sorted_price_timestamps = sorted(prices.keys())
+    def prefetch_periods(self, periods, workers=1):
+        """
+        Fetches the price history of many instance types at once
+        :param periods: A dict of (start, end) epoch seconds per
+                (instance type, availability zone)
+        :param workers: Number of histories fetched concurrently
+        """
 
-        summed_until_timestamp = start_time
-        for key_id in range(0, len(sorted_price_timestamps)):
-            price_timestamp = sorted_price_timestamps[key_id]
-            if (
-                key_id == len(sorted_price_timestamps) - 1
-                or end_time < sorted_price_timestamps[key_id + 1]
-            ):
-                # this is the last price measurement we want: add final part of
-                # price segment and exit
-                seconds_passed = (end_time - summed_until_timestamp).total_seconds()
-                summed_price = summed_price + (
-                    float(seconds_passed) * prices[price_timestamp] / 3600.0
-                )
-                return summed_price
-            if (
-                sorted_price_timestamps[key_id]
-                < summed_until_timestamp
-                < sorted_price_timestamps[key_id + 1]
-            ):
-                seconds_passed = (
-                    sorted_price_timestamps[key_id + 1] - summed_until_timestamp
-                ).total_seconds()
-                summed_price = summed_price + (
-                    float(seconds_passed) * prices[price_timestamp] / 3600.0
-                )
-                summed_until_timestamp = sorted_price_timestamps[key_id + 1]
+        def prefetch(item):
+            (instance_id, availability_zone), (start, end) = item
+            self.prefetch(
+                instance_id,
+                availability_zone,
+                datetime.datetime.fromtimestamp(start, tz=tz.tzutc()),
+                datetime.datetime.fromtimestamp(end, tz=tz.tzutc()),
+            )
+
+        if workers <= 1:
+            for item in periods.items():
+                prefetch(item)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # consume the results so that errors are raised
+            list(executor.map(prefetch, periods.items()))
+
+    def load_snapshot(self, snapshot: PriceSnapshot):
+        """
+        Uses the spot price histories of a snapshot. Billing queries inside
+        the periods they cover need no API call.
+        """
+        with self._locks_lock:
+            for key, series in snapshot.iter_spot_series():
+                self.all_prices[key] = series
+
+    def price_series(self) -> typing.Dict[tuple, SpotPriceSeries]:
+        """
+        :return: A copy of the price series fetched so far, per (instance
+                type, availability zone)
+        """
+        with self._locks_lock:
+            return dict(self.all_prices)
+
+    def fetch_summary(self):
+        """
+        :return: A dict with the number of price histories fetched, the
+                requests they took and the bytes downloaded
+        """
+        with self._locks_lock:
+            return {
+                "series": self.series_fetched,
+                "requests": self.requests_made,
+                "bytes": self.bytes_fetched,
+            }
+
+    def get_billed_price_for_period(
+        self, instance_id, availability_zone, start_time, end_time
+    ):
+        """
+        :return: The spot cost of one instance from start_time to end_time,
+                or None if there is no price history for it
+        """
+        # the price series may be extended by another thread, so it is only
+        # read while holding its lock
+        with self._get_lock((instance_id, availability_zone)):
+            self._populate_all_prices_if_needed(
+                instance_id, availability_zone, start_time, end_time
+            )
+            series = self.all_prices[(instance_id, availability_zone)]
+            if not len(series):
+                return None
+            return series.integrate(start_time.timestamp(), end_time.timestamp())
@@ -0,0 +1,87 @@
+"""
+In-process memo of the cost of clusters, for long running services that ask
+for the same clusters again and again.
+"""
+
+import collections
+import threading
+import time
+import typing
+
+from calculator.ledger import TERMINAL_STATES
+
+
+class ClusterCostCache:
+    """
+    Thread safe LRU cache of cost_dicts keyed by (cluster_id, start_date,
+    end_date). The cost of a cluster in a terminal state can not change, so
+    it is kept until evicted; the cost of a running cluster grows and is
+    only kept for running_ttl seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, running_ttl: float = 300.0):
+        """
+        :param max_size: Number of costs kept, the least recently used are
+                evicted first. 0 disables the cache.
+        :param running_ttl: Seconds the cost of a cluster that is not
+                terminated yet is reused for
+        """
+        self.max_size = max_size
+        self.running_ttl = running_ttl
+        # key -> (cost_dict, expiry time or None)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> typing.Optional[typing.Dict[str, float]]:
+        """
+        :return: A copy of the cached cost_dict, or None if there is no
+                valid entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cost_dict, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(cost_dict)
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, cost_dict: typing.Dict[str, float], state: str):
+        """
+        :param state: State of the cluster when its cost was computed
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = None
+        if state not in TERMINAL_STATES:
+            if self.running_ttl <= 0:
+                return
+            expires_at = time.monotonic() + self.running_ttl
+        with self._lock:
+            self._entries[key] = (dict(cost_dict), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> typing.Dict[str, int]:
+        """
+        :return: The hits, misses and evictions so far and the current size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,58 @@
+"""
+HTTP session shared by the downloads of the price lists.
+
+Every request of the pricing API goes through one requests.Session, so the
+TLS connections to the pricing endpoint are pooled and kept alive instead of
+being opened again for each of the index, regional index and offer files,
+and compressed responses are asked for.
+"""
+
+import os
+import threading
+
+# connections kept open per host, enough for the offers of a few regions
+# downloaded concurrently
+POOL_SIZE = 8
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    :return: The requests.Session of this process. A process forked after
+            the session was created (e.g. a pricing worker process) gets a
+            new one, as pooled sockets can not be shared between processes.
+    """
+    global _session, _session_pid
+    # requests is only imported once something is downloaded
+    import requests
+    import requests.adapters
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def bytes_received(response) -> int:
+    """
+    :return: The number of bytes of the body of a response read so far, as
+            sent over the wire: compressed bodies count for their compressed
+            size, not for the size of the content they decode to
+    """
+    tell = getattr(response.raw, "tell", None)
+    if tell is not None:
+        return tell()
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        return int(content_length)
+    return len(response.content)
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+import typing
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullInstrumentation:
+    """
+    Instrumentation that records nothing. It is used when instrumentation is
+    disabled, so every hook costs a single no-op method call.
+    """
+
+    enabled = False
+
+    def timer(self, name: str, **labels):
+        """
+        :return: A context manager measuring the time spent in its block
+        """
+        return _NULL_TIMER
+
+    def count(self, name: str, value: float = 1, **labels):
+        """
+        Adds value to a counter
+        """
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class _Timer:
+    __slots__ = ("_instrumentation", "_key", "_started")
+
+    def __init__(self, instrumentation, key):
+        self._instrumentation = instrumentation
+        self._key = key
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._instrumentation._observe(self._key, time.perf_counter() - self._started)
+        return False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+class Instrumentation(NullInstrumentation):
+    """
+    Thread safe collection of counters and timers, identified by a name and
+    a set of labels (e.g. the API operation).
+
+    Timers are kept as a number of observations and their total duration in
+    seconds, like Prometheus summaries without quantiles.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: typing.Dict[tuple, float] = {}
+        self._timers: typing.Dict[tuple, typing.List[float]] = {}
+
+    def timer(self, name: str, **labels):
+        return _Timer(self, _key(name, labels))
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            timer = self._timers.setdefault(key, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def snapshot(self):
+        """
+        :return: A dict with the list of counters and the list of timers,
+                sorted by name and labels
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted(self._timers.items())
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "timers": [
+                {"name": name, "labels": dict(labels), "count": count, "seconds": total}
+                for (name, labels), (count, total) in timers
+            ],
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix: str = "emr_cost_calculator_"):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+                Counters get a _total suffix and timers become summaries
+                with a _count and a _sum in seconds.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted(self._timers.items())
+        lines = []
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                lines.append("# TYPE {}{}_total counter".format(prefix, name))
+                previous = name
+            lines.append(
+                "{}{}_total{} {}".format(prefix, name, _format_labels(labels), value)
+            )
+        previous = None
+        for (name, labels), (count, total) in timers:
+            if name != previous:
+                lines.append("# TYPE {}{}_seconds summary".format(prefix, name))
+                previous = name
+            lines.append(
+                "{}{}_seconds_count{} {}".format(
+                    prefix, name, _format_labels(labels), count
+                )
+            )
+            lines.append(
+                "{}{}_seconds_sum{} {:.6f}".format(
+                    prefix, name, _format_labels(labels), total
+                )
+            )
+        return "\n".join(lines) + "\n"
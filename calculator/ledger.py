@@ -0,0 +1,188 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from dateutil import tz
+
+from calculator.pricing_cache import default_cache_dir
+
+# clusters in these states can not incur any further cost
+TERMINAL_STATES = ("TERMINATED", "TERMINATED_WITH_ERRORS")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    account TEXT NOT NULL,
+    region TEXT NOT NULL,
+    cluster_id TEXT NOT NULL,
+    created REAL,
+    state TEXT,
+    final INTEGER NOT NULL,
+    costs TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (account, region, cluster_id)
+);
+CREATE INDEX IF NOT EXISTS clusters_created ON clusters (account, region, created);
+CREATE TABLE IF NOT EXISTS listings (
+    account TEXT NOT NULL,
+    region TEXT NOT NULL,
+    created_after REAL NOT NULL,
+    created_before REAL NOT NULL
+);
+"""
+
+# ledgers written before clusters were keyed by account and region can not
+# tell which region their rows belong to, so their tables are dropped and
+# the costs computed again
+_DROP_UNSCOPED = """
+DROP INDEX IF EXISTS clusters_created;
+DROP TABLE IF EXISTS clusters;
+DROP TABLE IF EXISTS listings;
+"""
+
+
+def to_epoch(value: typing.Optional[datetime.datetime]):
+    """
+    :return: Epoch seconds of a datetime. Naive datetimes are taken as UTC,
+            like boto3 does when it sends them to AWS.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz.tzutc())
+    return value.timestamp()
+
+
+class CostLedger:
+    """
+    Persistent SQLite ledger of per-cluster cost results.
+
+    The cost of a cluster in a terminal state can not change anymore, so it
+    is stored as final and never computed again. The ledger also remembers
+    which creation periods have been listed completely: a report over such a
+    period whose clusters are all final is answered without any API call.
+
+    Clusters and listings are kept per region, and per account when one is
+    given, so that a ledger file can be shared between regions and accounts.
+    """
+
+    def __init__(self, path: typing.Optional[str] = None, account: str = ""):
+        """
+        :param account: Name of the AWS account (or profile) whose clusters
+                are stored, so that a ledger file used with several
+                accounts never mixes their clusters
+        """
+        if path is None:
+            path = os.path.join(default_cache_dir(), "ledger.sqlite")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.account = account
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(clusters)")
+            ]
+            if columns and "region" not in columns:
+                self._conn.executescript(_DROP_UNSCOPED)
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def get_final_cost(self, region: str, cluster_id: str) -> typing.Optional[dict]:
+        """
+        :return: The stored cost_dict of a cluster if it is final, else None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT costs FROM clusters WHERE account = ? AND region = ? "
+                "AND cluster_id = ? AND final = 1",
+                (self.account, region, cluster_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def store(
+        self,
+        region: str,
+        cluster_id: str,
+        created: typing.Optional[datetime.datetime],
+        state: typing.Optional[str],
+        cost_dict: dict,
+    ):
+        """
+        Records the cost of a cluster, as final if its state is terminal
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.account,
+                    region,
+                    cluster_id,
+                    to_epoch(created),
+                    state,
+                    1 if state in TERMINAL_STATES else 0,
+                    json.dumps(cost_dict),
+                    time.time(),
+                ),
+            )
+
+    def record_listing(
+        self,
+        region: str,
+        created_after: datetime.datetime,
+        created_before: datetime.datetime,
+    ):
+        """
+        Records that every cluster created in the period has been stored.
+        Only the part of the period already in the past is recorded, since
+        clusters may still be created in the rest of it.
+        """
+        start = to_epoch(created_after)
+        end = min(to_epoch(created_before), time.time())
+        if start is None or end <= start:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO listings VALUES (?, ?, ?, ?)",
+                (self.account, region, start, end),
+            )
+
+    def get_period_costs(
+        self,
+        region: str,
+        created_after: datetime.datetime,
+        created_before: datetime.datetime,
+    ) -> typing.Optional[typing.List[typing.Tuple[str, dict]]]:
+        """
+        :return: The (cluster_id, cost_dict) of every cluster of the region
+                created in the period if the period was listed before and all of them are
+                final, else None
+        """
+        start, end = to_epoch(created_after), to_epoch(created_before)
+        if start is None or end is None:
+            return None
+        with self._lock:
+            listed = self._conn.execute(
+                "SELECT 1 FROM listings WHERE account = ? AND region = ? "
+                "AND created_after <= ? AND created_before >= ?",
+                (self.account, region, start, end),
+            ).fetchone()
+            if listed is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT cluster_id, final, costs FROM clusters "
+                "WHERE account = ? AND region = ? AND created >= ? AND created <= ? "
+                "ORDER BY created, cluster_id",
+                (self.account, region, start, end),
+            ).fetchall()
+        if any(not final for _, final, _ in rows):
+            return None
+        return [(cluster_id, json.loads(costs)) for cluster_id, _, costs in rows]
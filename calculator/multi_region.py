@@ -0,0 +1,134 @@
+"""
+Total cost reports over several regions at once.
+
+The offer index is fetched once and shared. The price tables of the regions
+are then built in parallel processes, since parsing the offer files is CPU
+bound. Finally the clusters of every region are priced concurrently, one
+thread per region, each with its own EmrCostCalculator.
+"""
+
+import concurrent.futures
+import typing
+
+from calculator.calculator import Ec2EmrPricing, EmrCostCalculator
+from calculator.ledger import CostLedger
+from calculator.pricing_cache import PricingCache
+
+
+def _build_price_tables(region, index, cache, offline, parse_workers):
+    """
+    Runs in a worker process
+    :return: The (ec2_prices, emr_prices) tables of a region
+    """
+    pricing = Ec2EmrPricing(
+        region=region,
+        cache=cache,
+        offline=offline,
+        index=index,
+        parse_workers=parse_workers,
+    )
+    return pricing.ec2_prices, pricing.emr_prices
+
+
+class MultiRegionCostCalculator:
+    def __init__(
+        self,
+        regions: typing.List[str],
+        pricing_cache: typing.Optional[PricingCache] = None,
+        offline: bool = False,
+        instrumentation=None,
+        processes: typing.Optional[int] = None,
+        parse_workers: int = 1,
+    ):
+        """
+        :param regions: Regions whose clusters are priced
+        :param processes: Number of processes building the price tables,
+                one per region by default
+        :param parse_workers: Number of processes parsing each offer file,
+                in every one of those processes
+        :param instrumentation: Optional Instrumentation shared by the
+                calculators of all the regions. The price tables are built in
+                other processes, so their downloads are not recorded.
+        """
+        self.regions = list(regions)
+        index = None
+        if not offline:
+            index = Ec2EmrPricing.get_offer_index()
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes or len(self.regions)
+        ) as executor:
+            price_tables = list(
+                executor.map(
+                    _build_price_tables,
+                    self.regions,
+                    [index] * len(self.regions),
+                    [pricing_cache] * len(self.regions),
+                    [offline] * len(self.regions),
+                    [parse_workers] * len(self.regions),
+                )
+            )
+
+        self.calculators = {}
+        for region, (ec2_prices, emr_prices) in zip(self.regions, price_tables):
+            self.calculators[region] = EmrCostCalculator(
+                region=region,
+                ec2_emr_pricing=Ec2EmrPricing.from_prices(
+                    region, ec2_prices, emr_prices
+                ),
+                instrumentation=instrumentation,
+            )
+
+    def get_total_cost_by_dates(
+        self,
+        created_after,
+        created_before,
+        workers=1,
+        prefetch_spot=False,
+        ledger: typing.Optional[CostLedger] = None,
+    ) -> typing.Dict[str, float]:
+        """
+        Computes the total cost of every region concurrently
+        :param workers: Number of clusters computed concurrently in each region
+        :param prefetch_spot: See EmrCostCalculator.get_total_cost_by_dates
+        :param ledger: Optional CostLedger shared by the regions, which keeps
+                the clusters of each region apart
+        :return: A dict of the total cost per region, in the order of regions
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.regions)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self.calculators[region].get_total_cost_by_dates,
+                    created_after,
+                    created_before,
+                    workers=workers,
+                    ledger=ledger,
+                    prefetch_spot=prefetch_spot,
+                )
+                for region in self.regions
+            ]
+            return {
+                region: future.result() for region, future in zip(self.regions, futures)
+            }
+
+    def spot_fetch_summary(self):
+        """
+        :return: The SpotPricing.fetch_summary of all the regions added up
+        """
+        summary = {"series": 0, "requests": 0, "bytes": 0}
+        for calculator in self.calculators.values():
+            for key, value in calculator.spot_pricing.fetch_summary().items():
+                summary[key] += value
+        return summary
+
+    def api_call_summary(self):
+        """
+        :return: A dict of {operation: number of calls} per cluster id, over
+                all the regions
+        """
+        calls = {}
+        for calculator in self.calculators.values():
+            calls.update(calculator.api_call_summary())
+        return calls
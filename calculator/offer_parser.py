@@ -0,0 +1,516 @@
+"""
+Reduces AWS price list offer files to {instance_type: on demand price} tables.
+
+The EC2 offer file of a region is hundreds of MB of JSON of which only a few
+thousand SKUs are of interest, so it is parsed incrementally: the "products"
+and "terms" objects are walked entry by entry and every entry is decoded,
+filtered and dropped before the next one is read. Peak memory is bounded by
+the size of the largest single entry instead of the size of the file.
+
+With more than one worker, the entries are not decoded by the reading
+process at all: the text of the "products" and "terms" sections is cut into
+pieces of whole entries and handed to a process pool, which decodes and
+filters them. The results are merged in the order of the file, so the table
+is the same as with a single worker.
+"""
+
+import codecs
+import collections
+import concurrent.futures
+import json
+import re
+import typing
+
+CHUNK_SIZE = 1024 * 1024
+# a single value (e.g. the terms of a SKU) larger than this is taken for a
+# corrupt or truncated file instead of being buffered until the end of it
+MAX_VALUE_SIZE = 4 * CHUNK_SIZE
+
+_WHITESPACE = " \t\n\r"
+_WHITESPACE_RUN = re.compile(r"[ \t\n\r]*")
+# everything up to the next brace that is not inside a string. It stops at
+# the opening quote of a string that is not terminated in the buffer yet.
+_NO_BRACES = re.compile(r'[^"{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}]*)*')
+
+
+class OfferError(ValueError):
+    """
+    Raised when an offer file does not have the expected structure, e.g. a
+    SKU with more than one on demand term
+    """
+
+
+def iter_file_chunks(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    :return: An iterator over the bytes of a local offer file
+    """
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _iter_text(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class _JsonStream:
+    """
+    Minimal pull parser on top of json.JSONDecoder.raw_decode.
+
+    Objects can either be walked key by key with iter_object or decoded as
+    a whole with decode, so a caller only ever materialises the values it
+    chooses to.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = _iter_text(chunks)
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        # characters of the input discarded before the buffer
+        self._offset = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Appends the next chunk to the buffer, discarding what was consumed
+        :return: False if the input is exhausted
+        """
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            return False
+        self._offset += self._pos
+        self._buf = self._buf[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _check_value_size(self, error=None):
+        """
+        Fails once the value being read spans more than MAX_VALUE_SIZE
+        characters without being complete
+        """
+        if len(self._buf) - self._pos <= MAX_VALUE_SIZE:
+            return
+        position = self._pos if error is None else error.pos
+        raise ValueError(
+            "Malformed offer file at character {}: no complete value in {} "
+            "characters{}".format(
+                self._offset + position,
+                len(self._buf) - self._pos,
+                "" if error is None else " ({})".format(error.msg),
+            )
+        )
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of offer file")
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(
+                "Expected '{}' in offer file, got '{}'".format(char, self._peek())
+            )
+        self._pos += 1
+
+    def decode(self):
+        """
+        Decodes the next value completely
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                self._check_value_size(e)
+                if self._fill():
+                    continue
+                raise ValueError(
+                    "Malformed offer file at character {}: {}".format(
+                        self._offset + e.pos, e.msg
+                    )
+                )
+            # a number touching the end of the buffer might continue in the
+            # next chunk
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip(self):
+        """
+        Discards the next value. Objects are skipped one member at a time so
+        that huge unused sections never have to be held in memory at once.
+        """
+        if self._peek() == "{":
+            for _ in self.iter_object():
+                self.decode()
+        else:
+            self.decode()
+
+    def raw_object(self):
+        """
+        Consumes the next value, which must be an object, without decoding it
+        :return: Its JSON text
+        """
+        self._expect("{")
+        self._pos -= 1
+        depth = 0
+        scan = self._pos
+        while True:
+            scan = _NO_BRACES.match(self._buf, scan).end()
+            if scan == len(self._buf) or self._buf[scan] == '"':
+                # the object goes on in the next chunk
+                self._check_value_size()
+                offset = scan - self._pos
+                if not self._fill():
+                    raise ValueError("Unexpected end of offer file")
+                scan = self._pos + offset
+                continue
+            depth += 1 if self._buf[scan] == "{" else -1
+            scan += 1
+            if depth == 0:
+                text = self._buf[self._pos : scan]
+                self._pos = scan
+                return text
+
+    def _member_indent(self):
+        """
+        :return: The indentation of the members of the object whose opening
+                brace was just consumed, if they all start on a new line like
+                in the pretty-printed offer files, else None
+        """
+        while True:
+            end = _WHITESPACE_RUN.match(self._buf, self._pos).end()
+            if end < len(self._buf):
+                break
+            if not self._fill():
+                raise ValueError("Unexpected end of offer file")
+        space = self._buf[self._pos : end]
+        newline = space.rfind("\n")
+        if newline < 0 or self._buf[end] != '"' or newline == len(space) - 1:
+            return None
+        return space[newline + 1 :]
+
+    def iter_raw_members(self):
+        """
+        Walks the next object yielding pieces of its text, each one made of
+        complete members ('"key": value' separated by commas) to be decoded
+        elsewhere.
+
+        In a pretty-printed object every member starts on a new line at the
+        same indentation and the closing brace is on a line indented less.
+        Strings can not hold raw newlines, so such an object is cut at its
+        member boundaries with plain text searches, one piece per chunk read.
+        Other objects are cut one member at a time.
+        """
+        self._expect("{")
+        indent = self._member_indent()
+        if indent is None:
+            for key in self._iter_members():
+                yield json.dumps(key) + ":" + self.raw_object()
+            return
+
+        separator = "\n" + indent + '"'
+        closing = re.compile(r"\n[ \t]{0,%d}\}" % (len(indent) - 1))
+        scan = self._pos
+        while True:
+            match = closing.search(self._buf, scan)
+            if match is not None:
+                piece = self._buf[self._pos : match.start()]
+                self._pos = match.end()
+                yield piece
+                return
+            cut = self._buf.rfind(separator, self._pos)
+            if cut > self._pos:
+                yield self._buf[self._pos : cut]
+                self._pos = cut
+            # the closing line may be split between this chunk and the next
+            offset = max(scan, len(self._buf) - len(indent) - 1) - self._pos
+            if not self._fill():
+                raise ValueError("Unexpected end of offer file")
+            scan = self._pos + max(offset, 0)
+
+    def iter_object(self):
+        """
+        Walks the next object yielding its keys. The caller must consume the
+        value of every key (with decode, skip, raw_object, iter_object or
+        iter_raw_members) before asking
+        for the next one.
+        """
+        self._expect("{")
+        return self._iter_members()
+
+    def _iter_members(self):
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.decode()
+            self._expect(":")
+            yield key
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("}")
+                return
+
+
+def select_ec2_product(attributes):
+    """
+    :return: The instance type of a Linux shared tenancy on demand EC2 product
+            or None if the product is not one of those
+    """
+    try:
+        if (
+            attributes["tenancy"] == "Shared"
+            and attributes["operatingSystem"] == "Linux"
+            and attributes["operation"] == "RunInstances"
+            and attributes["capacitystatus"] == "Used"
+        ):
+            return attributes["instanceType"]
+    except KeyError:
+        pass
+    return None
+
+
+def select_emr_product(attributes):
+    """
+    :return: The instance type of an EMR product or None
+    """
+    if attributes.get("softwareType") == "EMR":
+        return attributes["instanceType"]
+    return None
+
+
+def get_on_demand_price(sku_info):
+    """
+    :param sku_info: The terms.OnDemand entry of a SKU
+    :return: Its hourly price in USD
+    """
+    if len(sku_info) > 1:
+        raise OfferError("More than one SKU for {}".format(sku_info))
+    _, sku_info_value = sku_info.popitem()
+    price_dimensions = sku_info_value["priceDimensions"]
+    if len(price_dimensions) > 1:
+        raise OfferError(
+            "More than one price dimension for {}".format(price_dimensions)
+        )
+    _, price_dimensions_value = price_dimensions.popitem()
+    return float(price_dimensions_value["pricePerUnit"]["USD"])
+
+
+def _build_price_table(sku_to_instance_type, sku_prices, unique_instance_types):
+    prices = {}
+    for sku, instance_type in sku_to_instance_type.items():
+        if sku not in sku_prices:
+            continue
+        if unique_instance_types and instance_type in prices:
+            raise OfferError(
+                "Instance price for {} already added".format(instance_type)
+            )
+        prices[instance_type] = sku_prices[sku]
+    return prices
+
+
+def parse_offer_document(
+    document, select_product, unique_instance_types=False
+) -> typing.Dict[str, float]:
+    """
+    Reduces an offer file that was already loaded as a whole
+    """
+    sku_to_instance_type = {}
+    for sku, product in document["products"].items():
+        instance_type = select_product(product.get("attributes", {}))
+        if instance_type is not None:
+            sku_to_instance_type[sku] = instance_type
+
+    on_demand = document["terms"]["OnDemand"]
+    sku_prices = {
+        sku: get_on_demand_price(on_demand[sku])
+        for sku in sku_to_instance_type
+        if sku in on_demand
+    }
+    return _build_price_table(sku_to_instance_type, sku_prices, unique_instance_types)
+
+
+def parse_offer_stream(
+    chunks, select_product, unique_instance_types=False, workers=1
+) -> typing.Dict[str, float]:
+    """
+    Reduces an offer file read incrementally from chunks of bytes, like the
+    ones given by requests' iter_content or iter_file_chunks.
+    :param workers: Number of processes decoding the entries
+    """
+    if workers > 1:
+        return _parse_offer_stream_parallel(
+            chunks, select_product, unique_instance_types, workers
+        )
+
+    stream = _JsonStream(chunks)
+    sku_to_instance_type = None
+    sku_prices = {}
+    # only filled if the terms come before the products in the file
+    unfiltered_terms = {}
+
+    for key in stream.iter_object():
+        if key == "products":
+            sku_to_instance_type = {}
+            for sku in stream.iter_object():
+                product = stream.decode()
+                instance_type = select_product(product.get("attributes", {}))
+                if instance_type is not None:
+                    sku_to_instance_type[sku] = instance_type
+        elif key == "terms":
+            for term_type in stream.iter_object():
+                if term_type != "OnDemand":
+                    stream.skip()
+                    continue
+                for sku in stream.iter_object():
+                    sku_info = stream.decode()
+                    if sku_to_instance_type is None:
+                        unfiltered_terms[sku] = sku_info
+                    elif sku in sku_to_instance_type:
+                        sku_prices[sku] = get_on_demand_price(sku_info)
+        else:
+            stream.skip()
+
+    if sku_to_instance_type is None:
+        raise ValueError("Offer file has no products")
+    for sku, sku_info in unfiltered_terms.items():
+        if sku in sku_to_instance_type:
+            sku_prices[sku] = get_on_demand_price(sku_info)
+    return _build_price_table(sku_to_instance_type, sku_prices, unique_instance_types)
+
+
+def _decode_members(piece):
+    return json.loads("{" + piece.rstrip().rstrip(",") + "}")
+
+
+def _select_products(select_product, piece):
+    """
+    Runs in a worker process
+    :param piece: Text of products members, see iter_raw_members
+    :return: The (sku, instance_type) of the selected products
+    """
+    selected = []
+    for sku, product in _decode_members(piece).items():
+        instance_type = select_product(product.get("attributes", {}))
+        if instance_type is not None:
+            selected.append((sku, instance_type))
+    return selected
+
+
+def _price_terms(skus, piece):
+    """
+    Runs in a worker process
+    :param skus: The SKUs to price
+    :param piece: Text of terms.OnDemand members, see iter_raw_members
+    :return: The (sku, on demand price) of the members of the SKUs
+    """
+    return [
+        (sku, get_on_demand_price(sku_info))
+        for sku, sku_info in _decode_members(piece).items()
+        if sku in skus
+    ]
+
+
+def _map_pieces(executor, workers, function, args, pieces):
+    """
+    Calls function(*args, piece) in the executor for every piece, with at
+    most two pieces per worker in flight at any time
+    :return: An iterator over the results of all the pieces, in order
+    """
+    in_flight = collections.deque()
+    for piece in pieces:
+        if len(in_flight) >= 2 * workers:
+            for result in in_flight.popleft().result():
+                yield result
+        in_flight.append(executor.submit(function, *(args + (piece,))))
+    while in_flight:
+        for result in in_flight.popleft().result():
+            yield result
+
+
+def _parse_offer_stream_parallel(
+    chunks, select_product, unique_instance_types, workers
+):
+    stream = _JsonStream(chunks)
+    sku_to_instance_type = None
+    sku_prices = {}
+    # only filled if the terms come before the products in the file
+    unfiltered_terms = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for key in stream.iter_object():
+            if key == "products":
+                sku_to_instance_type = dict(
+                    _map_pieces(
+                        executor,
+                        workers,
+                        _select_products,
+                        (select_product,),
+                        stream.iter_raw_members(),
+                    )
+                )
+            elif key == "terms":
+                for term_type in stream.iter_object():
+                    if term_type != "OnDemand":
+                        for _ in stream.iter_raw_members():
+                            pass
+                    elif sku_to_instance_type is None:
+                        unfiltered_terms.extend(stream.iter_raw_members())
+                    else:
+                        sku_prices.update(
+                            _map_pieces(
+                                executor,
+                                workers,
+                                _price_terms,
+                                (frozenset(sku_to_instance_type),),
+                                stream.iter_raw_members(),
+                            )
+                        )
+            else:
+                stream.skip()
+
+        if sku_to_instance_type is None:
+            raise ValueError("Offer file has no products")
+        sku_prices.update(
+            _map_pieces(
+                executor,
+                workers,
+                _price_terms,
+                (frozenset(sku_to_instance_type),),
+                unfiltered_terms,
+            )
+        )
+    return _build_price_table(sku_to_instance_type, sku_prices, unique_instance_types)
+
+
+def parse_ec2_offer(chunks, workers=1) -> typing.Dict[str, float]:
+    return parse_offer_stream(
+        chunks, select_ec2_product, unique_instance_types=True, workers=workers
+    )
+
+
+def parse_emr_offer(chunks, workers=1) -> typing.Dict[str, float]:
+    return parse_offer_stream(chunks, select_emr_product, workers=workers)
@@ -0,0 +1,117 @@
+import datetime
+import json
+import os
+import tempfile
+import time
+import typing
+
+
+def default_cache_dir():
+    """
+    :return: The directory where the reduced price tables are stored when
+            no explicit cache directory is given
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "aws-emr-cost-calculator")
+
+
+class PricingCache:
+    """
+    On-disk cache of the reduced {instance_type: price} tables built by
+    Ec2EmrPricing.
+
+    One file is kept per region and offer code. Each file remembers the
+    offer version (the currentVersionUrl of the regional index) it was built
+    from, so a new publication of the offer invalidates it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: typing.Optional[str] = None,
+        max_age: typing.Optional[datetime.timedelta] = datetime.timedelta(days=1),
+    ):
+        """
+        :param cache_dir: Directory holding the cache files
+        :param max_age: Age after which an entry is not used without checking
+                the offer version first. None means entries never expire.
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_age = max_age
+
+    def _path(self, region, offer_code):
+        return os.path.join(self.cache_dir, region, offer_code + ".json")
+
+    def _read(self, region, offer_code):
+        try:
+            with open(self._path(region, offer_code)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def load(
+        self, region: str, offer_code: str, version_url: typing.Optional[str] = None
+    ) -> typing.Optional[typing.Dict[str, float]]:
+        """
+        Returns the cached prices of an offer.
+
+        When version_url is given the entry is only returned if it was built
+        from that version of the offer. Without it the entry is only returned
+        if it is younger than max_age.
+        :return: The price table or None if there is no valid entry
+        """
+        entry = self._read(region, offer_code)
+        if entry is None:
+            return None
+        if version_url is not None:
+            if entry.get("version_url") != version_url:
+                return None
+        elif self.max_age is not None:
+            age = time.time() - entry.get("fetched_at", 0)
+            if age > self.max_age.total_seconds():
+                return None
+        return entry["prices"]
+
+    def load_validators(self, region: str, offer_code: str) -> typing.Optional[dict]:
+        """
+        :return: What is needed to ask the pricing API whether the offer
+                version of an entry is still the current one (see
+                Ec2EmrPricing._get_version_url), or None
+        """
+        entry = self._read(region, offer_code)
+        if entry is None:
+            return None
+        return entry.get("validators")
+
+    def store(
+        self,
+        region: str,
+        offer_code: str,
+        version_url: str,
+        prices: typing.Dict[str, float],
+        validators: typing.Optional[dict] = None,
+    ):
+        """
+        Atomically replaces the cached prices of an offer, so concurrent
+        calculator processes never read a partially written file.
+        :param validators: Optional validators of the regional index the
+                version was found in
+        """
+        path = self._path(region, offer_code)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        entry = {
+            "version_url": version_url,
+            "fetched_at": time.time(),
+            "prices": prices,
+            "validators": validators,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
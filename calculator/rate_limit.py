@@ -0,0 +1,235 @@
+"""
+Client side rate limiting of the EMR and EC2 API calls.
+
+Every operation gets its own token bucket, since AWS throttles each API
+action separately. When a call is throttled the rate of its bucket is halved
+and only that call is retried; every successful call then raises the rate a
+little, back up to its configured maximum (or, for an operation without a
+configured rate, to its DEFAULT_RATE_LIMITS entry). Paginated operations go through
+the limiter page by page, so a throttled page is retried with the same
+Marker or NextToken and the pages already fetched are kept.
+"""
+
+import collections
+import random
+import threading
+import time
+import typing
+
+from calculator.instrumentation import NULL_INSTRUMENTATION
+
+THROTTLING_ERROR_CODES = (
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+)
+
+# requests per second allowed for each API operation
+DEFAULT_RATE_LIMITS = {
+    "list_clusters": 5,
+    "describe_cluster": 10,
+    "list_instance_groups": 10,
+    "list_instance_fleets": 10,
+    "list_instances": 10,
+    "describe_spot_price_history": 10,
+}
+RECENT_CALLS = 20
+
+
+def _error_code(exception):
+    try:
+        return exception.response["Error"]["Code"]
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+def is_throttling_error(exception):
+    return _error_code(exception) in THROTTLING_ERROR_CODES
+
+
+def is_error_retriable(exception):
+    """
+    Use this function in order to back off only
+    if error is retriable
+    """
+    code = _error_code(exception)
+    if code is None:
+        return False
+    # when clusters are computed concurrently throttling is expected and
+    # retrying after a back off is the right thing to do
+    return code.startswith("5") or code in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Tokens are refilled at `rate` per second up to
+    `burst`; every call takes one token, waiting for it if none is left.
+
+    The rate adapts to throttling: it is halved (down to min_rate) by
+    on_throttle and raised by `increase` (up to max_rate) by on_success. A
+    bucket without a rate lets every call through until the first
+    throttling, after which it starts from half the rate the calls were
+    made at (or of max_rate if higher) and grows back up to max_rate, or
+    without bound if it has none.
+    """
+
+    def __init__(
+        self,
+        rate: typing.Optional[float],
+        burst: typing.Optional[float] = None,
+        min_rate: float = 0.5,
+        increase: float = 0.1,
+        max_rate: typing.Optional[float] = None,
+    ):
+        """
+        :param max_rate: Rate a bucket without a rate grows back to after
+                being throttled. A bucket with a rate grows back to it.
+        """
+        self.rate = None if rate is None else float(rate)
+        if self.rate is not None:
+            max_rate = self.rate
+        self.max_rate = None if max_rate is None else float(max_rate)
+        self.min_rate = min_rate if rate is None else min(float(min_rate), rate)
+        self.increase = increase
+        self._burst = burst
+        self.burst = float(burst if burst is not None else max(rate or 1, 1))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        # times of the latest calls, to know the rate of an unlimited bucket
+        self._recent_calls = collections.deque(maxlen=RECENT_CALLS)
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token, possibly one that will only be available in the
+        future.
+        :return: The number of seconds to wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is None:
+                self._recent_calls.append(now)
+                return 0.0
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """
+        :return: The number of seconds waited for a token
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def on_success(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            self.rate += self.increase
+            if self.max_rate is not None:
+                self.rate = min(self.max_rate, self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            if self.rate is None:
+                calls = self._recent_calls
+                elapsed = max(time.monotonic() - calls[0], 1.0) if calls else 1.0
+                # the slow down starts from the rate the calls were made at,
+                # which is not a limit the rate can not grow back above. A
+                # few calls say little about it, so it is at least max_rate.
+                self.rate = max(self.min_rate, len(calls) / elapsed)
+                if self.max_rate is not None:
+                    self.rate = max(self.rate, self.max_rate)
+                if self._burst is None:
+                    self.burst = max(self.rate, 1.0)
+                self._last = time.monotonic()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # the tokens left were accumulated at a rate AWS does not accept
+            self._tokens = min(self._tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Makes API calls through one adaptive TokenBucket per operation and
+    retries the single calls that fail with a retriable error
+    """
+
+    def __init__(
+        self,
+        rates: typing.Optional[typing.Dict[str, float]] = None,
+        max_attempts: int = 10,
+        backoff: float = 1.0,
+        max_backoff: float = 7.0,
+        instrumentation=None,
+    ):
+        """
+        :param rates: Maximum requests per second per API operation, e.g.
+                DEFAULT_RATE_LIMITS. The other operations are not limited
+                until they get throttled, then grow back to their
+                DEFAULT_RATE_LIMITS entry.
+        :param max_attempts: Attempts of a call before its error is raised
+        :param backoff: Seconds waited before retrying a call that failed
+                with a server error, doubled on every attempt up to
+                max_backoff. Throttled calls are slowed down by the token
+                bucket of their operation instead.
+        :param instrumentation: Optional Instrumentation counting the
+                retries, throttled calls and seconds waited for a token
+        """
+        self.rates = dict(rates or {})
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, operation: str) -> TokenBucket:
+        with self._lock:
+            bucket = self.buckets.get(operation)
+            if bucket is None:
+                bucket = TokenBucket(
+                    self.rates.get(operation),
+                    max_rate=DEFAULT_RATE_LIMITS.get(operation),
+                )
+                self.buckets[operation] = bucket
+            return bucket
+
+    def call(self, operation: str, function, *args, **kwargs):
+        """
+        :return: What function(*args, **kwargs) returns once it succeeds
+        """
+        bucket = self.bucket(operation)
+        instrumentation = self.instrumentation
+        attempt = 0
+        while True:
+            delay = bucket.acquire()
+            if delay:
+                instrumentation.count("rate_limit_wait", delay, operation=operation)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts or not is_error_retriable(e):
+                    raise
+                instrumentation.count("retries", operation=operation)
+                if is_throttling_error(e):
+                    instrumentation.count("throttles", operation=operation)
+                    bucket.on_throttle()
+                else:
+                    # the jitter keeps concurrent workers that failed together
+                    # from retrying in lockstep
+                    time.sleep(
+                        min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                        + random.uniform(0, self.backoff)
+                    )
+                continue
+            bucket.on_success()
+            return result
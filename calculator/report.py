@@ -0,0 +1,120 @@
+"""
+Per-cluster cost reports written one line per cluster as JSON Lines or CSV.
+
+Every line is flushed as soon as the cost of its cluster is known, so an
+interrupted report keeps everything computed so far. Reopening the same file
+with resume reads the cluster ids it already holds; they can be skipped and
+the report goes on where it stopped.
+"""
+
+import csv
+import json
+import os
+import typing
+
+FORMATS = ("jsonl", "csv")
+
+GROUP_TYPES = ("MASTER", "CORE", "TASK")
+COST_KINDS = ("EC2", "EMR", "EBS")
+CSV_COLUMNS = (
+    ["cluster_id"]
+    + ["{}.{}".format(group, kind) for group in GROUP_TYPES for kind in COST_KINDS]
+    + ["TOTAL"]
+)
+ROLLUP_COLUMNS = ["bucket", "group_type"] + list(COST_KINDS) + ["TOTAL"]
+
+
+def _truncate_partial_line(path):
+    """
+    Drops a last line left incomplete by an interrupted run, so appended
+    lines are not glued to it
+    """
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != size:
+            f.truncate(position)
+
+
+def read_checkpoint(path: str, output_format: str) -> typing.Tuple[set, float]:
+    """
+    :return: The ids of the clusters already in a report and the sum of
+            their total costs. A missing file holds no cluster.
+    """
+    cluster_ids = set()
+    total_cost = 0.0
+    if not os.path.exists(path):
+        return cluster_ids, total_cost
+    _truncate_partial_line(path)
+    with open(path, newline="") as f:
+        if output_format == "csv":
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            cluster_ids.add(record["cluster_id"])
+            total_cost += float(record.get("TOTAL") or 0)
+    return cluster_ids, total_cost
+
+
+class ClusterCostWriter:
+    """
+    Writes cost_dicts of clusters to a report file, one line each
+    """
+
+    def __init__(self, f: typing.TextIO, output_format: str):
+        """
+        :param f: File to write to. A CSV header is written if it is empty.
+        :param output_format: jsonl or csv
+        """
+        if output_format not in FORMATS:
+            raise ValueError(
+                "Unknown report format {}, use {}".format(
+                    output_format, " or ".join(FORMATS)
+                )
+            )
+        self.f = f
+        self.output_format = output_format
+        self._csv = None
+        if output_format == "csv":
+            self._csv = csv.DictWriter(f, CSV_COLUMNS, extrasaction="ignore")
+            if not f.seekable() or f.tell() == 0:
+                self._csv.writeheader()
+
+    def write(self, cluster_id: str, cost_dict: typing.Dict[str, float]):
+        record = {"cluster_id": cluster_id}
+        record.update(cost_dict)
+        if self._csv is not None:
+            for column in CSV_COLUMNS[1:]:
+                record.setdefault(column, 0)
+            self._csv.writerow(record)
+        else:
+            self.f.write(json.dumps(record) + "\n")
+        self.f.flush()
+
+
+def write_rollup(f: typing.TextIO, rollup, output_format: str):
+    """
+    Writes a CostRollup one line per bucket and group type
+    """
+    csv_writer = None
+    if output_format == "csv":
+        csv_writer = csv.DictWriter(f, ROLLUP_COLUMNS)
+        csv_writer.writeheader()
+    for bucket_start, group_type, cost_dict in rollup.iter_rows():
+        record = {"bucket": bucket_start.isoformat(), "group_type": group_type}
+        record.update(cost_dict)
+        if csv_writer is not None:
+            csv_writer.writerow(record)
+        else:
+            f.write(json.dumps(record) + "\n")
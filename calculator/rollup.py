@@ -0,0 +1,252 @@
+"""
+Costs rolled up into fixed time buckets, e.g. per hour or per day.
+
+Every instance contributes to the buckets it overlaps. Instead of splitting
+each instance interval bucket by bucket, the rollup keeps per bucket the
+change of the hourly rate at that bucket (a difference array) and a
+correction for the partial first and last buckets of every instance. Adding
+an instance is then O(1) whatever its length, and a final sweep over the
+buckets turns the rates back into costs. Spot instances are handled the same
+way with a count of running instances per (instance type, AZ), multiplied by
+the spot cost of each whole bucket computed once from the price series.
+
+Adding n instances to b buckets costs O(n + b), so months of hourly buckets
+over thousands of clusters stay cheap.
+"""
+
+import array
+import datetime
+import math
+import time
+import typing
+
+from dateutil import tz
+
+from calculator.batch import EBS_PRICE_PER_GB_HOUR, ON_DEMAND, SPOT, InstanceBatch
+
+BUCKET_SECONDS = {"hour": 3600, "day": 24 * 3600}
+COST_KINDS = ("EC2", "EMR", "EBS")
+
+
+def _to_epoch(date):
+    """
+    :param date: A datetime, naive ones being UTC like the calculator dates
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=tz.tzutc())
+    return date.timestamp()
+
+
+class CostRollup:
+    """
+    Bucket x group type x (EC2, EMR, EBS) cost matrix of a period
+    """
+
+    def __init__(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        bucket_seconds: int = BUCKET_SECONDS["hour"],
+    ):
+        """
+        :param start: Start of the period. The first bucket starts at the
+                closest multiple of bucket_seconds since the epoch before it,
+                so hours and days are aligned on UTC.
+        :param end: End of the period. Costs after it are not counted.
+        """
+        if bucket_seconds <= 0:
+            raise ValueError("The bucket size must be positive")
+        self.bucket_seconds = float(bucket_seconds)
+        self.period_start = _to_epoch(start)
+        self.end = _to_epoch(end)
+        self.start = math.floor(self.period_start / bucket_seconds) * bucket_seconds
+        self.bucket_count = max(
+            0, int(math.ceil((self.end - self.start) / self.bucket_seconds))
+        )
+        self.group_types = []
+        # per (group type, kind): change of the $ per hour rate at each bucket
+        # and the cost corrections of the partially covered buckets
+        self._rates = {}
+        self._corrections = {}
+        # per ((instance type, AZ), group type): change of the number of
+        # running spot instances at each bucket
+        self._spot_counts = {}
+        self._spot_series = {}
+
+    def _bucket(self, ts):
+        return int((ts - self.start) // self.bucket_seconds)
+
+    def _bucket_start(self, bucket):
+        return self.start + bucket * self.bucket_seconds
+
+    def _columns(self, group_type, kind):
+        key = (group_type, kind)
+        rates = self._rates.get(key)
+        if rates is None:
+            if group_type not in self.group_types:
+                self.group_types.append(group_type)
+            # one extra slot for instances ending exactly at the period end
+            rates = array.array("d", bytes(8 * (self.bucket_count + 1)))
+            self._rates[key] = rates
+            self._corrections[key] = array.array("d", rates)
+        return rates, self._corrections[key]
+
+    def _add_rate(self, rates, corrections, start, end, rate):
+        """
+        Adds a cost of rate $ per hour from start to end
+        """
+        first, last = self._bucket(start), self._bucket(end)
+        rates[first] += rate
+        rates[last] -= rate
+        corrections[first] -= rate * (start - self._bucket_start(first)) / 3600.0
+        corrections[last] += rate * (end - self._bucket_start(last)) / 3600.0
+
+    def _get_spot_series(self, instance_type, availability_zone, spot_pricing):
+        """
+        Fetches the price history of the whole period the first time an
+        instance type is seen, so every bucket can be priced with it
+        """
+        key = (instance_type, availability_zone)
+        series = self._spot_series.get(key)
+        if series is None:
+            spot_pricing.prefetch(
+                instance_type,
+                availability_zone,
+                datetime.datetime.fromtimestamp(self.start, tz=tz.tzutc()),
+                datetime.datetime.fromtimestamp(
+                    min(self.end, time.time()), tz=tz.tzutc()
+                ),
+            )
+            series = spot_pricing.all_prices[key]
+            self._spot_series[key] = series
+        return series
+
+    def add_batch(self, batch: InstanceBatch, ec2_emr_pricing, spot_pricing):
+        """
+        Adds the costs of all the instances of a batch. The batch can be
+        dropped afterwards, the rollup only keeps per bucket arrays.
+        """
+        instance_types = batch.instance_types.values
+        availability_zones = batch.availability_zones.values
+        group_types = batch.group_types.values
+        ec2_prices = [ec2_emr_pricing.ec2_prices.get(t) for t in instance_types]
+        emr_prices = [ec2_emr_pricing.get_emr_price(t) for t in instance_types]
+        columns = [
+            [self._columns(group_type, kind) for kind in COST_KINDS]
+            for group_type in group_types
+        ]
+
+        for i, start in enumerate(batch.starts):
+            start = max(start, self.period_start)
+            end = min(batch.ends[i], self.end)
+            if end <= start:
+                continue
+            type_code = batch.type_codes[i]
+            group = batch.group_codes[i]
+            (ec2_rates, ec2_corrections), emr_columns, ebs_columns = columns[group]
+            market = batch.market_codes[i]
+            if market == ON_DEMAND:
+                ec2_price = ec2_prices[type_code]
+                if ec2_price is None:
+                    ec2_emr_pricing.get_ec2_price(instance_types[type_code])
+                self._add_rate(ec2_rates, ec2_corrections, start, end, ec2_price)
+            elif market == SPOT:
+                instance_type = instance_types[type_code]
+                availability_zone = availability_zones[batch.az_codes[i]]
+                series = self._get_spot_series(
+                    instance_type, availability_zone, spot_pricing
+                )
+                if len(series):
+                    key = ((instance_type, availability_zone), group_types[group])
+                    counts = self._spot_counts.get(key)
+                    if counts is None:
+                        counts = array.array("d", bytes(8 * (self.bucket_count + 1)))
+                        self._spot_counts[key] = counts
+                    first, last = self._bucket(start), self._bucket(end)
+                    counts[first] += 1
+                    counts[last] -= 1
+                    ec2_corrections[first] -= series.integrate(
+                        self._bucket_start(first), start
+                    )
+                    ec2_corrections[last] += series.integrate(
+                        self._bucket_start(last), end
+                    )
+            self._add_rate(*emr_columns, start, end, emr_prices[type_code])
+            self._add_rate(
+                *ebs_columns,
+                start,
+                end,
+                batch.ebs_sizes[i] * EBS_PRICE_PER_GB_HOUR,
+            )
+
+    def _sweep(self, steps):
+        """
+        :return: The value in effect in each bucket given its changes
+        """
+        values = array.array("d", bytes(8 * self.bucket_count))
+        running = 0.0
+        for bucket in range(self.bucket_count):
+            running += steps[bucket]
+            values[bucket] = running
+        return values
+
+    def matrix(self) -> typing.Dict[str, typing.Dict[str, array.array]]:
+        """
+        :return: A dict of {group type: {kind: costs}} where costs is an
+                array with the cost of every bucket
+        """
+        bucket_hours = self.bucket_seconds / 3600.0
+        matrix = {}
+        for (group_type, kind), rates in self._rates.items():
+            costs = self._sweep(rates)
+            corrections = self._corrections[(group_type, kind)]
+            for bucket in range(self.bucket_count):
+                costs[bucket] = costs[bucket] * bucket_hours + corrections[bucket]
+            matrix.setdefault(group_type, {})[kind] = costs
+
+        bucket_costs = {}
+        for (series_key, group_type), counts in self._spot_counts.items():
+            whole_bucket_costs = bucket_costs.get(series_key)
+            if whole_bucket_costs is None:
+                series = self._spot_series[series_key]
+                boundaries = [
+                    series.cumulative_cost(self._bucket_start(bucket))
+                    for bucket in range(self.bucket_count + 1)
+                ]
+                whole_bucket_costs = [
+                    boundaries[bucket + 1] - boundaries[bucket]
+                    for bucket in range(self.bucket_count)
+                ]
+                bucket_costs[series_key] = whole_bucket_costs
+            running = self._sweep(counts)
+            costs = matrix[group_type]["EC2"]
+            for bucket in range(self.bucket_count):
+                if running[bucket]:
+                    costs[bucket] += running[bucket] * whole_bucket_costs[bucket]
+        return matrix
+
+    def bucket_starts(self) -> typing.List[datetime.datetime]:
+        return [
+            datetime.datetime.fromtimestamp(self._bucket_start(bucket), tz=tz.tzutc())
+            for bucket in range(self.bucket_count)
+        ]
+
+    def iter_rows(self):
+        """
+        :return: An iterator of (bucket start, group type, cost_dict) tuples,
+                bucket by bucket, where cost_dict has the EC2, EMR, EBS and
+                TOTAL costs of the group type in the bucket
+        """
+        matrix = self.matrix()
+        for bucket, bucket_start in enumerate(self.bucket_starts()):
+            for group_type in self.group_types:
+                cost_dict = {
+                    kind: matrix[group_type][kind][bucket] for kind in COST_KINDS
+                }
+                cost_dict["TOTAL"] = sum(cost_dict.values())
+                yield bucket_start, group_type, cost_dict
+
+    def total(self) -> float:
+        return sum(
+            sum(costs) for kinds in self.matrix().values() for costs in kinds.values()
+        )
@@ -0,0 +1,287 @@
+"""
+Compact binary snapshot of the prices of a region.
+
+A snapshot holds the EC2 on demand and EMR price tables and the spot price
+step functions fetched for a region, so that many short lived calculator
+processes can share them instead of each downloading and parsing the price
+lists. It is memory-mapped when loaded: the price arrays are read in place,
+the pages are shared by every process mapping the same file and nothing but
+the instance type names is decoded at start up.
+
+Layout, little endian, every section aligned on 8 bytes:
+
+    header       magic, format version, creation time and section sizes
+    strings      end offset of each string (uint32) then the utf-8 bytes.
+                 String 0 is the region, then the instance types, then the
+                 availability zones.
+    ec2 prices   float64 per instance type, NaN when there is no price
+    emr prices   float64 per instance type, NaN when there is no price
+    series       per spot series: instance type and availability zone string
+                 indexes, first point and number of points (uint32) and the
+                 covered period (float64)
+    points       timestamps, prices and cumulative costs of all the series,
+                 three float64 arrays
+"""
+
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import typing
+
+from calculator.spot_series import SpotPriceSeries
+
+MAGIC = b"EMRPRICE"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIId6I")
+_SERIES = struct.Struct("<4I2d")
+_NO_COVERAGE = float("nan")
+
+
+class SnapshotError(ValueError):
+    """
+    Raised when a file is not a price snapshot this version can read
+    """
+
+
+def _padding(size):
+    return b"\0" * (-size % 8)
+
+
+def _double_bytes(values):
+    doubles = array.array("d", values)
+    if sys.byteorder != "little":
+        doubles.byteswap()
+    return doubles.tobytes()
+
+
+def write_snapshot(
+    path: str,
+    region: str,
+    ec2_prices: typing.Mapping[str, float],
+    emr_prices: typing.Mapping[str, float],
+    spot_series: typing.Optional[typing.Mapping[tuple, SpotPriceSeries]] = None,
+):
+    """
+    Atomically writes a snapshot, so processes loading it concurrently never
+    see a partially written file
+    :param spot_series: SpotPriceSeries per (instance type, availability
+            zone), like SpotPricing.all_prices
+    """
+    spot_series = spot_series or {}
+    instance_types = sorted(
+        set(ec2_prices) | set(emr_prices) | set(t for t, _ in spot_series)
+    )
+    zones = sorted(set(az for _, az in spot_series))
+    strings = [region] + instance_types + zones
+    type_strings = {t: 1 + i for i, t in enumerate(instance_types)}
+    zone_strings = {z: 1 + len(instance_types) + i for i, z in enumerate(zones)}
+
+    encoded = [s.encode("utf-8") for s in strings]
+    ends, end = [], 0
+    for s in encoded:
+        end += len(s)
+        ends.append(end)
+    string_section = array.array("I", ends)
+    if sys.byteorder != "little":
+        string_section.byteswap()
+    string_bytes = string_section.tobytes() + b"".join(encoded)
+    string_bytes += _padding(len(string_bytes))
+
+    nan = float("nan")
+    ec2_bytes = _double_bytes([ec2_prices.get(t, nan) for t in instance_types])
+    emr_bytes = _double_bytes([emr_prices.get(t, nan) for t in instance_types])
+
+    series_records = []
+    timestamps, prices, integrals = [], [], []
+    for (instance_type, zone), series in sorted(spot_series.items()):
+        covered_start, covered_end = series.covered_start, series.covered_end
+        series_records.append(
+            _SERIES.pack(
+                type_strings[instance_type],
+                zone_strings[zone],
+                len(timestamps),
+                len(series),
+                _NO_COVERAGE if covered_start is None else covered_start,
+                _NO_COVERAGE if covered_end is None else covered_end,
+            )
+        )
+        timestamps.extend(series.timestamps)
+        prices.extend(series.prices)
+        integrals.extend(series.integrals)
+
+    header = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        0,
+        time.time(),
+        len(strings),
+        len(string_bytes),
+        len(instance_types),
+        len(zones),
+        len(series_records),
+        len(timestamps),
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for section in (
+                header + _padding(len(header)),
+                string_bytes,
+                ec2_bytes,
+                emr_bytes,
+                b"".join(series_records),
+                _double_bytes(timestamps),
+                _double_bytes(prices),
+                _double_bytes(integrals),
+            ):
+                f.write(section)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class SnapshotPriceTable(typing.Mapping[str, float]):
+    """
+    Read only {instance_type: price} mapping over a price array of a
+    snapshot. Instance types without a price are not in it.
+    """
+
+    def __init__(self, type_index: typing.Dict[str, int], prices):
+        self._type_index = type_index
+        self._prices = prices
+
+    def __getitem__(self, instance_type):
+        price = self._prices[self._type_index[instance_type]]
+        if math.isnan(price):
+            raise KeyError(instance_type)
+        return price
+
+    def __iter__(self):
+        for instance_type, i in self._type_index.items():
+            if not math.isnan(self._prices[i]):
+                yield instance_type
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class PriceSnapshot:
+    """
+    A memory-mapped snapshot written by write_snapshot
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError("{} is empty".format(path))
+        buffer = memoryview(self._mmap)
+        if len(buffer) < _HEADER.size:
+            raise SnapshotError("{} is not a price snapshot".format(path))
+        (
+            magic,
+            version,
+            _,
+            self.created_at,
+            string_count,
+            string_size,
+            type_count,
+            zone_count,
+            series_count,
+            point_count,
+        ) = _HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise SnapshotError("{} is not a price snapshot".format(path))
+        if version != FORMAT_VERSION:
+            raise SnapshotError(
+                "{} has snapshot format {}, expected {}".format(
+                    path, version, FORMAT_VERSION
+                )
+            )
+
+        offset = _HEADER.size + len(_padding(_HEADER.size))
+        ends = self._uint32s(buffer, offset, string_count)
+        text_offset = offset + 4 * string_count
+        strings, start = [], 0
+        for end in ends:
+            strings.append(
+                bytes(buffer[text_offset + start : text_offset + end]).decode("utf-8")
+            )
+            start = end
+        offset += string_size
+
+        self.region = strings[0]
+        instance_types = strings[1 : type_count + 1]
+        type_index = {t: i for i, t in enumerate(instance_types)}
+        self.ec2_prices = SnapshotPriceTable(
+            type_index, self._doubles(buffer, offset, type_count)
+        )
+        offset += 8 * type_count
+        self.emr_prices = SnapshotPriceTable(
+            type_index, self._doubles(buffer, offset, type_count)
+        )
+        offset += 8 * type_count
+
+        self._series = []
+        for i in range(series_count):
+            type_string, zone_string, first, count, start, end = _SERIES.unpack_from(
+                buffer, offset + i * _SERIES.size
+            )
+            self._series.append(
+                (
+                    strings[type_string],
+                    strings[zone_string],
+                    first,
+                    count,
+                    start,
+                    end,
+                )
+            )
+        offset += series_count * _SERIES.size
+        self._timestamps = self._doubles(buffer, offset, point_count)
+        self._prices = self._doubles(buffer, offset + 8 * point_count, point_count)
+        self._integrals = self._doubles(buffer, offset + 16 * point_count, point_count)
+
+    @staticmethod
+    def _doubles(buffer, offset, count):
+        view = buffer[offset : offset + 8 * count].cast("d")
+        if sys.byteorder == "little":
+            return view
+        doubles = array.array("d", view.tobytes())
+        doubles.byteswap()
+        return doubles
+
+    @staticmethod
+    def _uint32s(buffer, offset, count):
+        view = buffer[offset : offset + 4 * count].cast("I")
+        if sys.byteorder == "little":
+            return view
+        uint32s = array.array("I", view.tobytes())
+        uint32s.byteswap()
+        return uint32s
+
+    def iter_spot_series(self):
+        """
+        :return: An iterator of ((instance type, availability zone),
+                SpotPriceSeries) tuples. The series read their points from
+                the mapped file until they are extended.
+        """
+        for instance_type, zone, first, count, start, end in self._series:
+            series = SpotPriceSeries.from_arrays(
+                self._timestamps[first : first + count],
+                self._prices[first : first + count],
+                self._integrals[first : first + count],
+            )
+            if not math.isnan(start):
+                series.covered_start, series.covered_end = start, end
+            yield (instance_type, zone), series
@@ -0,0 +1,135 @@
+import array
+import bisect
+import typing
+
+
+class SpotPriceSeries:
+    """
+    Spot price history of one (instance type, availability zone) seen as a
+    step function: prices[i] is charged from timestamps[i] until
+    timestamps[i + 1]. The first price also applies before the first
+    timestamp and the last one after the last timestamp.
+
+    Timestamps are epoch seconds kept sorted in parallel arrays together with
+    the prefix sums of the cost (in price * hours) up to each timestamp, so
+    the cost of any period is found with two binary searches.
+
+    The three arrays are replaced together as a single tuple when the series
+    is extended, so a series can be integrated while another thread extends
+    it: every lookup reads one consistent version of them.
+    """
+
+    def __init__(self, timestamps=(), prices=()):
+        timestamps = array.array("d", timestamps)
+        prices = array.array("d", prices)
+        # (timestamps, prices, integrals)
+        self._arrays = (timestamps, prices, _build_integrals(timestamps, prices))
+        # period of time whose price changes have all been fetched
+        self.covered_start: typing.Optional[float] = None
+        self.covered_end: typing.Optional[float] = None
+
+    @classmethod
+    def from_arrays(cls, timestamps, prices, integrals):
+        """
+        Builds a series from already computed arrays, e.g. read in place
+        from a PriceSnapshot, without copying them
+        """
+        series = cls()
+        series._arrays = (timestamps, prices, integrals)
+        return series
+
+    @property
+    def timestamps(self):
+        return self._arrays[0]
+
+    @property
+    def prices(self):
+        return self._arrays[1]
+
+    @property
+    def integrals(self):
+        return self._arrays[2]
+
+    def __len__(self):
+        return len(self._arrays[0])
+
+    def covers(self, start: float, end: float, slack: float = 0.0):
+        """
+        :param slack: Seconds past the covered period end that are still
+                considered covered
+        :return: True if all the price changes between start and end have
+                been fetched
+        """
+        if self.covered_start is None:
+            return False
+        return self.covered_start <= start and end <= self.covered_end + slack
+
+    def missing_periods(self, start: float, end: float):
+        """
+        :return: The parts of [start, end] outside the covered period, as a
+                list of (start, end) tuples
+        """
+        if self.covered_start is None:
+            return [(start, end)]
+        missing = []
+        if start < self.covered_start:
+            missing.append((start, self.covered_start))
+        if end > self.covered_end:
+            missing.append((self.covered_end, end))
+        return missing
+
+    def extend(self, points: typing.Dict[float, float], start: float, end: float):
+        """
+        Merges newly fetched price changes and widens the covered period
+        :param points: Price per epoch timestamp fetched for [start, end]
+        """
+        if points:
+            timestamps, prices, _ = self._arrays
+            merged = dict(zip(timestamps, prices))
+            merged.update(points)
+            timestamps = sorted(merged)
+            prices = array.array("d", [merged[t] for t in timestamps])
+            timestamps = array.array("d", timestamps)
+            # published at once, after the arrays are complete
+            self._arrays = (timestamps, prices, _build_integrals(timestamps, prices))
+        if self.covered_start is None:
+            self.covered_start, self.covered_end = start, end
+        else:
+            self.covered_start = min(self.covered_start, start)
+            self.covered_end = max(self.covered_end, end)
+
+    def cumulative_cost(self, ts: float):
+        """
+        :return: Cost of one instance from the first timestamp until ts
+                (negative before it)
+        """
+        return _cumulative_cost(self._arrays, ts)
+
+    def integrate(self, start: float, end: float):
+        """
+        :return: Cost of one instance running from start to end
+        """
+        if end <= start:
+            return 0.0
+        # both ends from the same arrays, as an extend may add points before
+        # the first timestamp and so move the origin of the integrals
+        arrays = self._arrays
+        return _cumulative_cost(arrays, end) - _cumulative_cost(arrays, start)
+
+
+def _build_integrals(timestamps, prices):
+    integrals = array.array("d", [0.0] * len(timestamps))
+    for i in range(1, len(timestamps)):
+        integrals[i] = (
+            integrals[i - 1]
+            + prices[i - 1] * (timestamps[i] - timestamps[i - 1]) / 3600.0
+        )
+    return integrals
+
+
+def _cumulative_cost(arrays, ts):
+    timestamps, prices, integrals = arrays
+    i = bisect.bisect_right(timestamps, ts) - 1
+    if i < 0:
+        return (ts - timestamps[0]) * prices[0] / 3600.0
+    return integrals[i] + (ts - timestamps[i]) * prices[i] / 3600.0
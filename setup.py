@@ -11,7 +11,7 @@ setuptools.setup(
     long_description=open('README.md').read(),
     long_description_content_type="text/markdown",
     url="https://github.com/mauropelucchi/aws-emr-cost-calculator",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks"]),
     classifiers=[
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.7',
@@ -19,7 +19,6 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=['requests[security]>=2.18.3',
-                      'retrying',
                       'boto3>=1.9',
                       'docopt']
 )
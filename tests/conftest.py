@@ -0,0 +1,89 @@
+"""
+Calculators wired to the fake EMR and EC2 clients of the benchmarks, which
+serve the same synthetic clusters and spot price histories every time.
+"""
+
+import datetime
+import os
+import sys
+
+import pytest
+from dateutil import tz
+
+# the tests use the fixtures and fake clients of the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fake_aws, fixtures  # noqa: E402
+from calculator.async_calculator import AsyncEmrCostCalculator  # noqa: E402
+from calculator.calculator import (  # noqa: E402
+    Ec2EmrPricing,
+    EmrCostCalculator,
+    SpotPricing,
+)
+from calculator.rate_limit import RateLimiter  # noqa: E402
+
+REGION = "us-east-1"
+START = datetime.datetime(2024, 1, 1, tzinfo=tz.tzutc()).timestamp()
+SPAN = 3 * 24 * 3600
+INSTANCE_TYPES = [fixtures.instance_type_name(i) for i in range(8)]
+CLUSTERS = fake_aws.synthetic_clusters(3, 60, START, SPAN)
+# a period all the clusters were created in, and all their instances ran in
+CREATED_AFTER = datetime.datetime(2024, 1, 1)
+CREATED_BEFORE = datetime.datetime(2024, 2, 1)
+
+
+def _pricing():
+    return Ec2EmrPricing.from_prices(
+        REGION,
+        {t: 0.1 * (i + 1) for i, t in enumerate(INSTANCE_TYPES)},
+        {t: 0.02 * (i + 1) for i, t in enumerate(INSTANCE_TYPES)},
+    )
+
+
+def _spot_pricing():
+    # the fake clients are never throttled, so the calls are not limited
+    spot_pricing = SpotPricing(region=REGION, rate_limiter=RateLimiter())
+    spot_pricing.client_ec2 = fake_aws.FakeEc2Client()
+    return spot_pricing
+
+
+@pytest.fixture
+def make_calculator():
+    """
+    :return: A function creating an EmrCostCalculator over CLUSTERS, served
+            as instance groups or as instance fleets
+    """
+
+    def make(fleets=False, **kwargs):
+        return EmrCostCalculator(
+            region=REGION,
+            emr_client=fake_aws.FakeEmrClient(CLUSTERS, fleets=fleets),
+            spot_pricing=_spot_pricing(),
+            ec2_emr_pricing=_pricing(),
+            rate_limiter=RateLimiter(),
+            **kwargs
+        )
+
+    return make
+
+
+@pytest.fixture
+def make_async_calculator():
+    """
+    :return: A function creating an AsyncEmrCostCalculator over CLUSTERS,
+            closed at the end of the test
+    """
+    created = []
+
+    def make(fleets=False):
+        async_calculator = AsyncEmrCostCalculator(region=REGION)
+        calculator = async_calculator.calculator
+        calculator.conn = fake_aws.FakeEmrClient(CLUSTERS, fleets=fleets)
+        calculator.spot_pricing = _spot_pricing()
+        calculator.ec2_emr_pricing = _pricing()
+        created.append(async_calculator)
+        return async_calculator
+
+    yield make
+    for async_calculator in created:
+        async_calculator.close()
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from conftest import CLUSTERS, CREATED_AFTER, CREATED_BEFORE
+
+
+@pytest.mark.parametrize("fleets", [False, True])
+def test_async_cluster_cost_matches_sync(
+    fleets, make_calculator, make_async_calculator
+):
+    calculator = make_calculator(fleets)
+    async_calculator = make_async_calculator(fleets)
+    for cluster_id in CLUSTERS:
+        expected = calculator.get_cluster_cost(cluster_id)
+        cost_dict = asyncio.run(async_calculator.get_cluster_cost(cluster_id))
+        assert cost_dict.keys() == expected.keys()
+        for key, cost in expected.items():
+            assert cost_dict[key] == pytest.approx(cost, abs=1e-6)
+
+
+@pytest.mark.parametrize("fleets", [False, True])
+def test_async_total_matches_sync(fleets, make_calculator, make_async_calculator):
+    expected = make_calculator(fleets).get_total_cost_by_dates(
+        CREATED_AFTER, CREATED_BEFORE
+    )
+    total = asyncio.run(
+        make_async_calculator(fleets).get_total_cost_by_dates(
+            CREATED_AFTER, CREATED_BEFORE
+        )
+    )
+    assert total == pytest.approx(expected, abs=1e-6)
@@ -0,0 +1,81 @@
+"""
+Every way of costing a period must give the same total, and checking the
+price lists again with a warm cache must only get 304 Not Modified answers.
+"""
+
+import asyncio
+
+import pytest
+
+from benchmarks import fake_aws, run
+from calculator.archive import ResponseArchive
+from calculator.batch import InstanceBatch
+from calculator.calculator import Ec2EmrPricing, EmrCostCalculator
+from calculator.pricing_cache import PricingCache
+from conftest import CLUSTERS, CREATED_AFTER, CREATED_BEFORE, REGION
+
+
+def _batch_total(calculator):
+    batch = InstanceBatch()
+    for cluster_id in CLUSTERS:
+        calculator.get_cluster_instance_batch(cluster_id, batch=batch)
+    return calculator.get_batch_cost(batch)["TOTAL"]
+
+
+def _replay_total(calculator, path):
+    calculator.get_total_cost_by_dates(CREATED_AFTER, CREATED_BEFORE)
+    calculator.save_archive(path)
+    replay = EmrCostCalculator(replay=ResponseArchive.load(path))
+    return replay.get_total_cost_by_dates(CREATED_AFTER, CREATED_BEFORE)
+
+
+@pytest.mark.parametrize("fleets", [False, True])
+def test_every_path_gives_the_same_total(
+    fleets, make_calculator, make_async_calculator, tmp_path
+):
+    expected = make_calculator(fleets).get_total_cost_by_dates(
+        CREATED_AFTER, CREATED_BEFORE
+    )
+    totals = {
+        "workers": make_calculator(fleets).get_total_cost_by_dates(
+            CREATED_AFTER, CREATED_BEFORE, workers=4
+        ),
+        "prefetch_spot": make_calculator(fleets).get_total_cost_by_dates(
+            CREATED_AFTER, CREATED_BEFORE, workers=4, prefetch_spot=True
+        ),
+        "batch": _batch_total(make_calculator(fleets)),
+        "rollup": make_calculator(fleets)
+        .get_cost_rollup(CREATED_AFTER, CREATED_BEFORE)
+        .total(),
+        "async": asyncio.run(
+            make_async_calculator(fleets).get_total_cost_by_dates(
+                CREATED_AFTER, CREATED_BEFORE
+            )
+        ),
+        "replay": _replay_total(
+            make_calculator(fleets, capture=ResponseArchive(REGION)),
+            str(tmp_path / "archive.json.gz"),
+        ),
+    }
+    assert expected > 0
+    for name, total in totals.items():
+        assert total == pytest.approx(expected, abs=1e-6), name
+
+
+def test_revalidation_with_a_warm_cache_is_not_modified(tmp_path):
+    data = run.Fixtures({"--products": "200", "--offer_file": None}, str(tmp_path))
+    server = fake_aws.PricingServer(data.offer_dir)
+    try:
+        LocalPricing = type("LocalPricing", (Ec2EmrPricing,), {"url_base": server.url})
+        cache = PricingCache(cache_dir=str(tmp_path / "cache"))
+        pricing = LocalPricing(region=REGION, cache=cache)
+        ec2_prices = dict(pricing.ec2_prices)
+        assert server.calls["http_get"] > 0
+
+        server.calls.clear()
+        pricing = LocalPricing(region=REGION, cache=cache)
+        assert pricing.ec2_prices == ec2_prices
+        assert server.calls["not_modified"] > 0
+        assert server.calls["http_get"] == 0
+    finally:
+        server.close()